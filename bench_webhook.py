@@ -0,0 +1,70 @@
+"""Benchmark do GET /webhook/telein: rota FastAPI atual x rota rápida (ASGI puro)
+
+Roda tudo em processo (httpx.ASGITransport) e simula o IPLUC com um MockTransport,
+então mede só o custo do nosso lado.
+
+Uso:
+    python bench_webhook.py [quantidade_de_requisicoes]
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault("IPLUC_API_KEY", "chave-de-benchmark-0123456789")
+
+import httpx
+
+import endvan
+
+QUERY = "nome=Maria%20Souza&telefone=11987654321&opcao=1&cpf=12345678901&mailing=URA&campanha=INSS"
+
+
+async def ipluc_falso(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(201, json={"id": 1})
+
+
+async def medir(nome: str, total: int, fast_route: bool, verbose: bool):
+    endvan.TELEIN_FAST_ROUTE = fast_route
+    endvan.VERBOSE_LOGS = verbose
+    endvan._http_client = httpx.AsyncClient(transport=httpx.MockTransport(ipluc_falso))
+
+    transport = httpx.ASGITransport(app=endvan.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Aquecimento
+        for _ in range(50):
+            await client.get(f"/webhook/telein?{QUERY}")
+
+        latencias = []
+        bytes_resposta = 0
+        inicio = time.perf_counter()
+        for _ in range(total):
+            t0 = time.perf_counter()
+            response = await client.get(f"/webhook/telein?{QUERY}")
+            latencias.append(time.perf_counter() - t0)
+            bytes_resposta += len(response.content)
+        duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    print(
+        f"{nome:<32} {total / duracao:>9.0f} req/s"
+        f"   p50 {latencias[len(latencias) // 2] * 1e6:>7.0f} µs"
+        f"   p99 {latencias[int(len(latencias) * 0.99)] * 1e6:>7.0f} µs"
+        f"   resposta {bytes_resposta // total:>5} bytes"
+    )
+
+
+async def main(total: int):
+    # Logs e prints do webhook vão para /dev/null para não medir o terminal
+    logging.disable(logging.CRITICAL)
+    devnull = open(os.devnull, "w")
+    endvan.print = lambda *args, **kwargs: print(*args, file=devnull, **kwargs)
+
+    await medir("rota atual (VERBOSE_LOGS=true)", total, fast_route=False, verbose=True)
+    await medir("rota atual (VERBOSE_LOGS=false)", total, fast_route=False, verbose=False)
+    await medir("rota rápida", total, fast_route=True, verbose=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
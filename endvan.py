@@ -1,12 +1,24 @@
 from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, Tag, Discriminator, model_validator
+from typing import Optional, Dict, Any, List, Union, Literal, Annotated
+from collections import Counter
+from urllib.parse import parse_qsl
 import json
 from datetime import datetime
 import httpx
 import asyncio
 import os
 import uuid
+import hmac
+import hashlib
+import sys
+import time
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import tempfile
 
 import logging
 
@@ -17,7 +29,30 @@ logger = logging.getLogger(__name__)
 import re
 
 
-app = FastAPI(title="Telein Webhook API", description="API para receber webhooks do Telein")
+# Ciclo de vida da aplicação (início e fim de cada worker)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ACCEPTING_WEBHOOKS
+    if LOOP_LAG_MONITOR_ENABLED:
+        LOOP_MONITOR.start()
+    snapshot_task = asyncio.create_task(salvar_snapshots_eventos())
+    recuperar_entregas_spool()
+    spool_task = asyncio.create_task(verificar_spool_periodicamente())
+    probe_task = asyncio.create_task(sondar_destinos_periodicamente())
+    yield
+    # Para de aceitar webhooks e drena as entregas antes de encerrar
+    ACCEPTING_WEBHOOKS = False
+    probe_task.cancel()
+    spool_task.cancel()
+    snapshot_task.cancel()
+    drained, persisted = await drenar_entregas(SHUTDOWN_DRAIN_SECONDS)
+    logger.info(f"🛑 Worker {os.getpid()} encerrando: {drained} entregas concluídas, {persisted} persistidas em {DELIVERY_SPOOL_DIR}")
+    await fechar_http_client()
+    LOOP_MONITOR.stop()
+    PROFILER.stop()
+
+
+app = FastAPI(title="Telein Webhook API", description="API para receber webhooks do Telein", lifespan=lifespan)
 
 # Função para formatar telefone
 def formatar_telefone(telefone: str) -> str:
@@ -59,230 +94,519 @@ API_KEYS = {
     }
 }
 
+# Segredos aceitos para autenticar o webhook (separados por vírgula para permitir rotação)
+# Ex.: WEBHOOK_SECRET="segredo_novo,segredo_antigo"
+WEBHOOK_SECRETS = tuple(
+    s.strip().encode("utf-8")
+    for s in os.getenv("WEBHOOK_SECRET", "").split(",")
+    if s.strip()
+)
+
+# Header com a assinatura HMAC-SHA256 do body (formato "sha256=<hex>" ou só "<hex>")
+SIGNATURE_HEADER = "x-telein-signature"
+
+# Query param com o token compartilhado (formato GET do Telein)
+TOKEN_QUERY_PARAM = "token"
+
+# Tamanho máximo do body do POST (rejeitado antes de ler o restante)
+WEBHOOK_MAX_BODY_BYTES = int(os.getenv("WEBHOOK_MAX_BODY_BYTES", "65536"))
+
+if not WEBHOOK_SECRETS:
+    logger.warning("WEBHOOK_SECRET não configurado - webhook aceitando requisições sem autenticação!")
+
+# Contadores simples por worker
+METRICS: Dict[str, int] = {
+    "webhook_auth_ok": 0,
+    "webhook_auth_rejected": 0,
+    "webhook_validation_rejected": 0,
+    "deadline_overrun_queue": 0,
+    "deadline_overrun_connect": 0,
+    "deadline_overrun_send": 0,
+    "deadline_overrun_handler": 0,
+    "delivery_connect_failures": 0,
+    "delivery_retries": 0,
+    "deliveries_deferred": 0,
+    "shutdown_drained": 0,
+    "shutdown_persisted": 0,
+    "spool_recovered": 0,
+    "spool_retry_scheduled": 0,
+    "spool_failed": 0,
+}
+
+# Verifica a autenticação do webhook antes de qualquer parse
+def verificar_assinatura(request: Request, body: bytes = b"") -> bool:
+    """Valida assinatura HMAC do body ou token na query string (tempo constante)"""
+    if not WEBHOOK_SECRETS:
+        return True
+
+    signature = request.headers.get(SIGNATURE_HEADER)
+    if not signature:
+        # Token na query só vale para o formato GET; POST precisa assinar o body
+        if request.method != "GET":
+            return _contar_autenticacao(False)
+        return verificar_token(request.query_params.get(TOKEN_QUERY_PARAM, ""))
+
+    if signature.startswith("sha256="):
+        signature = signature[7:]
+    signature = signature.encode("ascii", errors="ignore")
+    valid = False
+    # Compara com todos os segredos para não vazar qual deles falhou
+    for secret in WEBHOOK_SECRETS:
+        expected = hmac.new(secret, body, hashlib.sha256).hexdigest().encode("ascii")
+        valid |= hmac.compare_digest(expected, signature)
+    return _contar_autenticacao(valid)
+
+# Valida o token compartilhado do formato GET (tempo constante)
+def verificar_token(token: str) -> bool:
+    if not WEBHOOK_SECRETS:
+        return True
+    token = token.encode("utf-8")
+    valid = False
+    for secret in WEBHOOK_SECRETS:
+        valid |= hmac.compare_digest(secret, token)
+    return _contar_autenticacao(valid)
+
+# Query string sem o token, para logs e registros
+def query_sem_token(request: Request) -> Dict[str, str]:
+    return {k: v for k, v in request.query_params.items() if k != TOKEN_QUERY_PARAM}
+
+def _contar_autenticacao(valid: bool) -> bool:
+    if valid:
+        METRICS["webhook_auth_ok"] += 1
+    else:
+        METRICS["webhook_auth_rejected"] += 1
+    return valid
+
+# Prazo total de cada webhook (o Telein fica aguardando a resposta)
+WEBHOOK_DEADLINE_SECONDS = float(os.getenv("WEBHOOK_DEADLINE_SECONDS", "8"))
+# Abaixo desse tempo restante não vale a pena tentar enviar: a entrega é adiada
+DELIVERY_MIN_BUDGET_SECONDS = float(os.getenv("DELIVERY_MIN_BUDGET_SECONDS", "0.5"))
+# Novas tentativas quando a conexão falha (nada chegou ao destino)
+DELIVERY_RETRIES = int(os.getenv("DELIVERY_RETRIES", "1"))
+# Folga do limite total do POST além dos timeouts por etapa (já limitados ao prazo)
+DELIVERY_DEADLINE_SLACK_SECONDS = float(os.getenv("DELIVERY_DEADLINE_SLACK_SECONDS", "0.25"))
+# Espera antes de tentar de novo uma entrega adiada
+DELIVERY_DEFER_DELAY_SECONDS = float(os.getenv("DELIVERY_DEFER_DELAY_SECONDS", "1"))
+
+# Timeouts por destino (URL completa ou "default"), em segundos
+DESTINATION_TIMEOUTS = {
+    "default": {
+        "connect": float(os.getenv("DELIVERY_CONNECT_TIMEOUT", "3")),
+        "write": float(os.getenv("DELIVERY_WRITE_TIMEOUT", "5")),
+        "read": float(os.getenv("DELIVERY_READ_TIMEOUT", "10")),
+        "pool": float(os.getenv("DELIVERY_POOL_TIMEOUT", "2"))
+    }
+}
+
+# Instante (time.monotonic) em que o prazo do webhook atual acaba
+PRAZO: ContextVar[Optional[float]] = ContextVar("prazo", default=None)
+
+class PrazoEsgotado(Exception):
+    """O prazo do webhook acabou antes de a entrega ser enviada"""
+
+class FalhaConexao(Exception):
+    """Não foi possível conectar ao destino (ainda havia prazo); nada foi enviado"""
+
+# Inicia o prazo do webhook atual
+def iniciar_prazo(segundos: float = WEBHOOK_DEADLINE_SECONDS):
+    PRAZO.set(time.monotonic() + segundos)
+
+# Tempo restante do prazo atual (None = sem prazo)
+def tempo_restante() -> Optional[float]:
+    prazo = PRAZO.get()
+    if prazo is None:
+        return None
+    return prazo - time.monotonic()
+
+def _config_timeouts(endpoint_url: str) -> Dict[str, float]:
+    return {**DESTINATION_TIMEOUTS["default"], **DESTINATION_TIMEOUTS.get(endpoint_url, {})}
+
+# Timeouts do destino limitados pelo tempo restante
+def timeouts_destino(endpoint_url: str, restante: Optional[float]) -> httpx.Timeout:
+    config = _config_timeouts(endpoint_url)
+    if restante is not None:
+        config = {nome: min(valor, restante) for nome, valor in config.items()}
+    return httpx.Timeout(**config)
+
+# Cliente HTTP compartilhado pelo worker (mantém o pool de conexões)
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=timeouts_destino("default", None),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _http_client
+
+async def fechar_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# POST respeitando o prazo: conexão e retentativas consomem o tempo restante
+async def enviar_com_prazo(client: httpx.AsyncClient, endpoint_url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> httpx.Response:
+    tentativa = 0
+    while True:
+        restante = tempo_restante()
+        if restante is not None and restante < DELIVERY_MIN_BUDGET_SECONDS:
+            raise PrazoEsgotado(f"Prazo esgotado antes do envio ({restante:.2f}s restantes)")
+        saude = saude_destino(endpoint_url)
+        inicio = time.monotonic()
+        try:
+            request = client.post(endpoint_url, json=payload, headers=headers, timeout=timeouts_destino(endpoint_url, restante))
+            if restante is None:
+                response = await request
+            else:
+                # Folga para que a expiração na conexão chegue como ConnectTimeout/PoolTimeout do httpx
+                # (nada enviado, pode adiar); este limite só pega o envio/leitura já em andamento
+                response = await asyncio.wait_for(request, timeout=restante + DELIVERY_DEADLINE_SLACK_SECONDS)
+            saude.registrar((time.monotonic() - inicio) * 1000, response.status_code < 500, None if response.status_code < 500 else f"HTTP {response.status_code}")
+            return response
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            saude.registrar((time.monotonic() - inicio) * 1000, False, type(e).__name__)
+            # A requisição não saiu: pode tentar de novo ou adiar com segurança.
+            # Só é estouro de prazo se o tempo restante era menor que o timeout configurado
+            etapa = "pool" if isinstance(e, httpx.PoolTimeout) else "connect"
+            if (
+                isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout))
+                and restante is not None
+                and restante < _config_timeouts(endpoint_url)[etapa]
+            ):
+                METRICS["deadline_overrun_connect"] += 1
+                raise PrazoEsgotado(f"Prazo esgotado conectando a {endpoint_url} ({etapa})") from e
+            if tentativa >= DELIVERY_RETRIES:
+                METRICS["delivery_connect_failures"] += 1
+                raise FalhaConexao(f"Falha de conexão com {endpoint_url}: {type(e).__name__}") from e
+            tentativa += 1
+            METRICS["delivery_retries"] += 1
+        except asyncio.TimeoutError as e:
+            saude.registrar((time.monotonic() - inicio) * 1000, False, "DeadlineExceeded")
+            raise httpx.ReadTimeout("Prazo do webhook esgotado durante o envio") from e
+        except httpx.HTTPError as e:
+            saude.registrar((time.monotonic() - inicio) * 1000, False, type(e).__name__)
+            raise
+
+# Saúde de cada destino: taxa de sucesso e latência (EWMA e p99) das entregas e sondagens
+PROBE_INTERVAL_SECONDS = float(os.getenv("PROBE_INTERVAL_SECONDS", "15"))
+PROBE_TIMEOUT_SECONDS = float(os.getenv("PROBE_TIMEOUT_SECONDS", "5"))
+
+class DestinationHealth:
+    def __init__(self, window: int = 200, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.ewma_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[str] = None
+
+    def registrar(self, latency_ms: float, ok: bool, error: Optional[str] = None):
+        self.latencies.append(latency_ms)
+        self.outcomes.append(ok)
+        self.ewma_ms = latency_ms if self.ewma_ms is None else self.alpha * latency_ms + (1 - self.alpha) * self.ewma_ms
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        if error:
+            self.last_error = error
+        self.last_check = datetime.now().isoformat()
+
+    def success_rate(self) -> Optional[float]:
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def p99_ms(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordenadas = sorted(self.latencies)
+        return ordenadas[min(int(len(ordenadas) * 0.99), len(ordenadas) - 1)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        success_rate = self.success_rate()
+        p99 = self.p99_ms()
+        return {
+            "samples": len(self.outcomes),
+            "success_rate": None if success_rate is None else round(success_rate, 3),
+            "ewma_ms": None if self.ewma_ms is None else round(self.ewma_ms, 1),
+            "p99_ms": None if p99 is None else round(p99, 1),
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_check": self.last_check
+        }
+
+DESTINATION_HEALTH: Dict[str, DestinationHealth] = {}
+
+def saude_destino(endpoint_url: str) -> DestinationHealth:
+    saude = DESTINATION_HEALTH.get(endpoint_url)
+    if saude is None:
+        saude = DESTINATION_HEALTH[endpoint_url] = DestinationHealth()
+    return saude
+
+# Sonda o destino com um HEAD pelo cliente compartilhado (sem enviar lead);
+# qualquer resposta abaixo de 500 mostra que o destino está de pé
+async def sondar_destino(endpoint_url: str):
+    saude = saude_destino(endpoint_url)
+    inicio = time.monotonic()
+    try:
+        response = await get_http_client().head(endpoint_url, timeout=PROBE_TIMEOUT_SECONDS)
+        ok = response.status_code < 500
+        saude.registrar((time.monotonic() - inicio) * 1000, ok, None if ok else f"HTTP {response.status_code}")
+    except Exception as e:
+        # Qualquer falha (inclusive URL inválida) conta como sondagem ruim, sem derrubar a tarefa
+        if not isinstance(e, httpx.HTTPError):
+            logger.error(f"❌ Erro ao sondar {endpoint_url}: {type(e).__name__}: {e}")
+        saude.registrar((time.monotonic() - inicio) * 1000, False, type(e).__name__)
+
+# Tarefa de fundo: sonda todos os destinos configurados
+async def sondar_destinos_periodicamente():
+    while True:
+        await asyncio.gather(*(sondar_destino(url) for url in set(DESTINATION_ENDPOINTS.values())))
+        await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+
 # Função para enviar dados para outros endpoints
 async def forward_to_endpoint(endpoint_url: str, data: Dict[str, Any], event_type: str = "unknown"):
     """Envia dados para outro endpoint"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        client = get_http_client()
+        
+        # Formata dados para a API da IPLUC
+        if "api.ipluc.com" in endpoint_url:
+            # Log completo dos dados recebidos
+            logger.info(f"=== DADOS RECEBIDOS DO TELEIN ===")
+            logger.info(f"Event type: {event_type}")
+            if VERBOSE_LOGS:
+                logger.info(f"Data completo: {json.dumps(mascarar_dados(data), indent=2)}")
             
-            # Formata dados para a API da IPLUC
-            if "api.ipluc.com" in endpoint_url:
-                # Log completo dos dados recebidos
-                logger.info(f"=== DADOS RECEBIDOS DO TELEIN ===")
-                logger.info(f"Event type: {event_type}")
-                logger.info(f"Data completo: {json.dumps(data, indent=2)}")
-                
-                # Extrai dados do lead do Telein - tenta diferentes estruturas
-                lead_data = data.get("lead_data", {})
-                client_data = data.get("client_data", {})
-                call_data = data.get("call_data", {})
-                
-                # Se não encontrar lead_data ou client_data, usa o próprio data
-                if not lead_data and not client_data and not call_data:
-                    lead_data = data
-                    client_data = data
-                    call_data = data
-                
-                # Tenta extrair nome de diferentes campos possíveis
-                nome = (
-                    lead_data.get("nome") or 
-                    client_data.get("nome") or 
-                    call_data.get("nome") or
-                    lead_data.get("name") or 
-                    client_data.get("name") or 
-                    call_data.get("name") or
-                    lead_data.get("nome_completo") or 
-                    client_data.get("nome_completo") or 
-                    call_data.get("nome_completo") or
-                    lead_data.get("cliente_nome") or 
-                    client_data.get("cliente_nome") or 
-                    call_data.get("cliente_nome") or
-                    ""
-                )
-                
-                # Tenta extrair telefone de diferentes campos possíveis
-                telefone_raw = (
-                    str(lead_data.get("telefone") or "") or
-                    str(client_data.get("telefone") or "") or
-                    str(call_data.get("telefone") or "") or
-                    str(lead_data.get("phone") or "") or
-                    str(client_data.get("phone") or "") or
-                    str(call_data.get("phone") or "") or
-                    str(lead_data.get("telefone_1") or "") or
-                    str(client_data.get("telefone_1") or "") or
-                    str(call_data.get("telefone_1") or "") or
-                    str(lead_data.get("cliente_telefone") or "") or
-                    str(client_data.get("cliente_telefone") or "") or
-                    str(call_data.get("cliente_telefone") or "") or
-                    str(data.get("telefone") or "") or
-                    str(data.get("phone") or "") or
-                    ""
-                )
-                
-                # Formata o telefone
-                telefone = formatar_telefone(telefone_raw)
-                
-                # Tenta extrair CPF 
-                cpf = (
-                     lead_data.get("CPF") or 
-                    client_data.get("CPF") or 
-                    lead_data.get("cpf") or 
-                    client_data.get("cpf") or 
-                    call_data.get("cpf") or
-                    lead_data.get("documento") or 
-                    client_data.get("documento") or 
-
-                    call_data.get("documento") or
-                    lead_data.get("cliente_cpf") or 
-                    client_data.get("cliente_cpf") or 
-                    call_data.get("cliente_cpf") or
-                    data.get("cpf") or
-                    data.get("documento") or
-
-                    lead_data.get("cpf_cnpj") or 
-                    client_data.get("cpf_cnpj") or 
-
-                    ""
-                )
-                
-                # Tenta extrair mailing de diferentes campos possíveis
-                mailing = (
-                    lead_data.get("mailing") or 
-                    client_data.get("mailing") or 
-                    call_data.get("mailing") or
-                    lead_data.get("campanha") or 
-                    client_data.get("campanha") or 
-                    call_data.get("campanha") or
-                    lead_data.get("campaign") or 
-                    client_data.get("campaign") or 
-                    call_data.get("campaign") or
-                    lead_data.get("campanha_nome") or 
-                    client_data.get("campanha_nome") or 
-                    call_data.get("campanha_nome") or
-                    lead_data.get("campaign_name") or 
-                    client_data.get("campaign_name") or 
-                    call_data.get("campaign_name") or
-                    data.get("mailing") or
-                    data.get("campanha") or
-                    data.get("campaign") or
-                    ""
-                )
-                
-                # Tenta extrair campanha de diferentes campos possíveis
-                campanha = (
-                    lead_data.get("campanha") or 
-                    client_data.get("campanha") or 
-                    call_data.get("campanha") or
-                    lead_data.get("campaign") or 
-                    client_data.get("campaign") or 
-                    call_data.get("campaign") or
-                    lead_data.get("campanha_nome") or 
-                    client_data.get("campanha_nome") or 
-                    call_data.get("campanha_nome") or
-                    lead_data.get("campaign_name") or 
-                    client_data.get("campaign_name") or 
-                    call_data.get("campaign_name") or
-                    lead_data.get("campanha_id") or 
-                    client_data.get("campanha_id") or 
-                    call_data.get("campanha_id") or
-                    lead_data.get("campaign_id") or 
-                    client_data.get("campaign_id") or 
-                    call_data.get("campaign_id") or
-                    data.get("campanha") or
-                    data.get("campaign") or
-                    ""
-                )
-                
-                logger.info(f"=== DADOS EXTRAÍDOS ===")
-                logger.info(f"Nome: '{nome}'")
-                logger.info(f"Telefone: '{telefone}'")
-                logger.info(f"CPF: '{cpf}'")
-                logger.info(f"Mailing: '{mailing}'")
-                logger.info(f"Campanha: '{campanha}'")
-                
-                # Verifica se tem dados mínimos - agora aceita apenas telefone
-                if not telefone:
-                    logger.error("ERRO: Nenhum telefone encontrado nos dados!")
-                    return {
-                        "status": "error",
-                        "forwarded_to": endpoint_url,
-                        "error": "Dados insuficientes: telefone não encontrado"
-                    }
-                
-                # Se não tem nome, usa um nome padrão
-                if not nome:
-                    nome = "Cliente Telein"
-                    logger.warning(f"Nome não encontrado, usando padrão: {nome}")
-                
-                # Formata payload para IPLUC conforme documentação
-                payload = {
-                    "id": int(str(uuid.uuid4().int)[:7]),  
-                    "status_id": 15389,  
-                    "nome": nome,
-                    "telefone_1": telefone,
-                    "cpf": cpf,
-                    "utm_source": "URA",
-                    "cod_convenio": "INSS",
-                    "referrer": mailing if mailing else "URA",
-                    "utm_campaign": campanha if campanha else "URA"
-                }
-                
-                # Headers conforme documentação da IPLUC
-                headers = {
-                    "Content-Type": "application/json",
-                    "apikey": API_KEYS['ipluc']['api_key']
-                }
-                
-                # Debug: log da chave sendo enviada (sem mostrar completa)
-                api_key = API_KEYS['ipluc']['api_key']
-                logger.info(f"=== ENVIANDO PARA IPLUC ===")
-                logger.info(f"URL: {endpoint_url}")
-                logger.info(f"API Key: {api_key[:10]}...{api_key[-10:] if len(api_key) > 20 else '***'}")
-                logger.info(f"Payload: {json.dumps(payload, indent=2)}")
-                
-                # Verifica se a API key está configurada
-                if api_key == "SUA_API_KEY_AQUI":
-                    logger.error("ERRO: API Key da IPLUC não está configurada!")
-                    return {
-                        "status": "error",
-                        "forwarded_to": endpoint_url,
-                        "error": "API Key da IPLUC não configurada"
-                    }
-                
-            else:
-                # Formato padrão para outros endpoints
-                payload = {
-                    "source": "telein_webhook",
-                    "event_type": event_type,
-                    "data": data,
-                    "timestamp": datetime.now().isoformat()
-                }
-                headers = {"Content-Type": "application/json"}
+            # Extrai dados do lead do Telein - tenta diferentes estruturas
+            lead_data = data.get("lead_data", {})
+            # Formulários de contato trazem os dados do cliente em form_data
+            client_data = data.get("client_data") or data.get("form_data", {})
+            call_data = data.get("call_data", {})
             
-            response = await client.post(endpoint_url, json=payload, headers=headers)
+            # Se não encontrar lead_data ou client_data, usa o próprio data
+            if not lead_data and not client_data and not call_data:
+                lead_data = data
+                client_data = data
+                call_data = data
             
-            logger.info(f"=== RESPOSTA DA IPLUC ===")
-            logger.info(f"Status Code: {response.status_code}")
-            logger.info(f"Response Headers: {dict(response.headers)}")
-            logger.info(f"Response Body: {response.text}")
+            # Tenta extrair nome de diferentes campos possíveis
+            nome = (
+                lead_data.get("nome") or 
+                client_data.get("nome") or 
+                call_data.get("nome") or
+                lead_data.get("name") or 
+                client_data.get("name") or 
+                call_data.get("name") or
+                lead_data.get("nome_completo") or 
+                client_data.get("nome_completo") or 
+                call_data.get("nome_completo") or
+                lead_data.get("cliente_nome") or 
+                client_data.get("cliente_nome") or 
+                call_data.get("cliente_nome") or
+                ""
+            )
+            
+            # Tenta extrair telefone de diferentes campos possíveis
+            telefone_raw = (
+                str(lead_data.get("telefone") or "") or
+                str(client_data.get("telefone") or "") or
+                str(call_data.get("telefone") or "") or
+                str(lead_data.get("phone") or "") or
+                str(client_data.get("phone") or "") or
+                str(call_data.get("phone") or "") or
+                str(lead_data.get("telefone_1") or "") or
+                str(client_data.get("telefone_1") or "") or
+                str(call_data.get("telefone_1") or "") or
+                str(lead_data.get("cliente_telefone") or "") or
+                str(client_data.get("cliente_telefone") or "") or
+                str(call_data.get("cliente_telefone") or "") or
+                str(data.get("telefone") or "") or
+                str(data.get("phone") or "") or
+                ""
+            )
+            
+            # Formata o telefone
+            telefone = formatar_telefone(telefone_raw)
+            atualizar_registro(phone_suffix=telefone[-4:] or None)
             
-            if response.status_code in [200, 201, 202]:
-                logger.info(f"✅ Dados enviados com sucesso para {endpoint_url}")
+            # Tenta extrair CPF 
+            cpf = (
+                 lead_data.get("CPF") or 
+                client_data.get("CPF") or 
+                lead_data.get("cpf") or 
+                client_data.get("cpf") or 
+                call_data.get("cpf") or
+                lead_data.get("documento") or 
+                client_data.get("documento") or 
+
+                call_data.get("documento") or
+                lead_data.get("cliente_cpf") or 
+                client_data.get("cliente_cpf") or 
+                call_data.get("cliente_cpf") or
+                data.get("cpf") or
+                data.get("documento") or
+
+                lead_data.get("cpf_cnpj") or 
+                client_data.get("cpf_cnpj") or 
+
+                ""
+            )
+            
+            # Tenta extrair mailing de diferentes campos possíveis
+            mailing = (
+                lead_data.get("mailing") or 
+                client_data.get("mailing") or 
+                call_data.get("mailing") or
+                lead_data.get("campanha") or 
+                client_data.get("campanha") or 
+                call_data.get("campanha") or
+                lead_data.get("campaign") or 
+                client_data.get("campaign") or 
+                call_data.get("campaign") or
+                lead_data.get("campanha_nome") or 
+                client_data.get("campanha_nome") or 
+                call_data.get("campanha_nome") or
+                lead_data.get("campaign_name") or 
+                client_data.get("campaign_name") or 
+                call_data.get("campaign_name") or
+                data.get("mailing") or
+                data.get("campanha") or
+                data.get("campaign") or
+                ""
+            )
+            
+            # Tenta extrair campanha de diferentes campos possíveis
+            campanha = (
+                lead_data.get("campanha") or 
+                client_data.get("campanha") or 
+                call_data.get("campanha") or
+                lead_data.get("campaign") or 
+                client_data.get("campaign") or 
+                call_data.get("campaign") or
+                lead_data.get("campanha_nome") or 
+                client_data.get("campanha_nome") or 
+                call_data.get("campanha_nome") or
+                lead_data.get("campaign_name") or 
+                client_data.get("campaign_name") or 
+                call_data.get("campaign_name") or
+                lead_data.get("campanha_id") or 
+                client_data.get("campanha_id") or 
+                call_data.get("campanha_id") or
+                lead_data.get("campaign_id") or 
+                client_data.get("campaign_id") or 
+                call_data.get("campaign_id") or
+                data.get("campanha") or
+                data.get("campaign") or
+                ""
+            )
+            
+            logger.info(f"=== DADOS EXTRAÍDOS ===")
+            logger.info(f"Nome: '{_mascarar_valor('nome', nome)}'")
+            logger.info(f"Telefone: '{_mascarar_valor('telefone', telefone)}'")
+            logger.info(f"CPF: '{_mascarar_valor('cpf', cpf)}'")
+            logger.info(f"Mailing: '{mailing}'")
+            logger.info(f"Campanha: '{campanha}'")
+            
+            # Verifica se tem dados mínimos - agora aceita apenas telefone
+            if not telefone:
+                logger.error("ERRO: Nenhum telefone encontrado nos dados!")
                 return {
-                    "status": "success",
+                    "status": "error",
                     "forwarded_to": endpoint_url,
-                    "response_status": response.status_code,
-                    "response_data": response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
+                    "error": "Dados insuficientes: telefone não encontrado"
                 }
-            else:
-                logger.error(f"❌ Erro ao enviar dados para {endpoint_url}: {response.status_code}")
+            
+            # Se não tem nome, usa um nome padrão
+            if not nome:
+                nome = "Cliente Telein"
+                logger.warning(f"Nome não encontrado, usando padrão: {nome}")
+            
+            # Formata payload para IPLUC conforme documentação
+            payload = {
+                "id": int(str(uuid.uuid4().int)[:7]),  
+                "status_id": 15389,  
+                "nome": nome,
+                "telefone_1": telefone,
+                "cpf": cpf,
+                "utm_source": "URA",
+                "cod_convenio": "INSS",
+                "referrer": mailing if mailing else "URA",
+                "utm_campaign": campanha if campanha else "URA"
+            }
+            atualizar_registro(lead=mascarar_dados(payload))
+            
+            # Headers conforme documentação da IPLUC
+            headers = {
+                "Content-Type": "application/json",
+                "apikey": API_KEYS['ipluc']['api_key']
+            }
+            
+            # Debug: log da chave sendo enviada (sem mostrar completa)
+            api_key = API_KEYS['ipluc']['api_key']
+            logger.info(f"=== ENVIANDO PARA IPLUC ===")
+            logger.info(f"URL: {endpoint_url}")
+            logger.info(f"API Key: {api_key[:10]}...{api_key[-10:] if len(api_key) > 20 else '***'}")
+            if VERBOSE_LOGS:
+                logger.info(f"Payload: {json.dumps(mascarar_dados(payload), indent=2)}")
+            
+            # Verifica se a API key está configurada
+            if api_key == "SUA_API_KEY_AQUI":
+                logger.error("ERRO: API Key da IPLUC não está configurada!")
                 return {
                     "status": "error",
                     "forwarded_to": endpoint_url,
-                    "response_status": response.status_code,
-                    "error": response.text
+                    "error": "API Key da IPLUC não configurada"
                 }
-                
+            
+        else:
+            # Formato padrão para outros endpoints
+            payload = {
+                "source": "telein_webhook",
+                "event_type": event_type,
+                "data": data,
+                "timestamp": datetime.now().isoformat()
+            }
+            headers = {"Content-Type": "application/json"}
+        
+        response = await enviar_com_prazo(client, endpoint_url, payload, headers)
+        
+        logger.info(f"=== RESPOSTA DA IPLUC ===")
+        logger.info(f"Status Code: {response.status_code}")
+        if VERBOSE_LOGS:
+            logger.info(f"Response Headers: {dict(response.headers)}")
+            logger.info(f"Response Body: {response.text}")
+        
+        if response.status_code in [200, 201, 202]:
+            logger.info(f"✅ Dados enviados com sucesso para {endpoint_url}")
+            return {
+                "status": "success",
+                "forwarded_to": endpoint_url,
+                "response_status": response.status_code,
+                "response_data": response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
+            }
+        else:
+            logger.error(f"❌ Erro ao enviar dados para {endpoint_url}: {response.status_code}")
+            return {
+                "status": "error",
+                "forwarded_to": endpoint_url,
+                "response_status": response.status_code,
+                "error": response.text
+            }
+            
+    except (PrazoEsgotado, FalhaConexao):
+        # Nada foi enviado: quem chamou decide adiar a entrega
+        raise
+    except httpx.TimeoutException as e:
+        # Estourou durante o envio: o lead pode ter chegado, então não reenviamos
+        METRICS["deadline_overrun_send"] += 1
+        logger.error(f"❌ Timeout ao enviar dados para {endpoint_url}: {type(e).__name__}")
+        return {
+            "status": "error",
+            "forwarded_to": endpoint_url,
+            "error": f"timeout: {type(e).__name__}"
+        }
     except Exception as e:
         logger.error(f"❌ Erro ao enviar dados para {endpoint_url}: {str(e)}")
         return {
@@ -291,16 +615,487 @@ async def forward_to_endpoint(endpoint_url: str, data: Dict[str, Any], event_typ
             "error": str(e)
         }
 
+# Lê mapas no formato "chave:valor,chave:valor" das variáveis de ambiente
+def _ler_mapa_env(nome: str, padrao: str) -> Dict[str, str]:
+    mapa = {}
+    for item in os.getenv(nome, padrao).split(","):
+        if ":" in item:
+            chave, valor = item.split(":", 1)
+            mapa[chave.strip()] = valor.strip()
+    return mapa
+
+# Classes de prioridade das entregas e seus pesos (fatia de despacho durante backlog)
+DELIVERY_PRIORITY_WEIGHTS = {
+    classe: int(peso)
+    for classe, peso in _ler_mapa_env("DELIVERY_PRIORITY_WEIGHTS", "hot:8,normal:3,low:1").items()
+}
+DELIVERY_DEFAULT_PRIORITY = os.getenv("DELIVERY_DEFAULT_PRIORITY", "normal")
+# Tecla -> classe (ex.: "1:hot" = "tecle 1 para falar com um atendente")
+DELIVERY_PRIORITY_KEYS = _ler_mapa_env("DELIVERY_PRIORITY_KEYS", "1:hot")
+# Campanha -> classe (tem precedência sobre a tecla)
+DELIVERY_PRIORITY_CAMPAIGNS = _ler_mapa_env("DELIVERY_PRIORITY_CAMPAIGNS", "")
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "10"))
+
+# Escolhe a classe de prioridade pela campanha e pela tecla
+def classe_prioridade(data: Dict[str, Any], key: Optional[str] = None) -> str:
+    for secao in ("client_data", "lead_data", "call_data"):
+        dados = data.get(secao) or {}
+        campanha = dados.get("campanha") or dados.get("campaign")
+        if campanha and str(campanha) in DELIVERY_PRIORITY_CAMPAIGNS:
+            return DELIVERY_PRIORITY_CAMPAIGNS[str(campanha)]
+    if key is not None and key in DELIVERY_PRIORITY_KEYS:
+        return DELIVERY_PRIORITY_KEYS[key]
+    return DELIVERY_DEFAULT_PRIORITY
+
+# Agendador de entregas: limita a concorrência e, quando há fila, libera as vagas
+# por round-robin ponderado entre as classes (classes de peso baixo não ficam sem vez)
+class DeliveryScheduler:
+    def __init__(self, concurrency: int, weights: Dict[str, int]):
+        self.concurrency = concurrency
+        self.weights = dict(weights)
+        self.active = 0
+        self.queues: Dict[str, deque] = {}
+        self.current: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def _classe(self, classe: str) -> str:
+        if classe not in self.weights:
+            classe = DELIVERY_DEFAULT_PRIORITY
+        if classe not in self.queues:
+            self.queues[classe] = deque()
+            self.current[classe] = 0
+            self.stats[classe] = {"dispatched": 0, "max_depth": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+        return classe
+
+    def set_weights(self, weights: Dict[str, int]):
+        self.weights.update(weights)
+
+    def _registrar_espera(self, classe: str, enqueued_at: float):
+        wait_ms = (time.monotonic() - enqueued_at) * 1000
+        stats = self.stats[classe]
+        stats["dispatched"] += 1
+        stats["wait_ms_total"] += wait_ms
+        stats["wait_ms_max"] = max(stats["wait_ms_max"], wait_ms)
+
+    def _proxima_classe(self) -> Optional[str]:
+        # Smooth weighted round-robin (mesmo algoritmo do nginx) entre as filas não vazias
+        escolhida = None
+        total = 0
+        for classe, fila in self.queues.items():
+            if not fila:
+                continue
+            peso = max(self.weights.get(classe, 1), 1)
+            self.current[classe] += peso
+            total += peso
+            if escolhida is None or self.current[classe] > self.current[escolhida]:
+                escolhida = classe
+        if escolhida is not None:
+            self.current[escolhida] -= total
+        return escolhida
+
+    def _liberar(self):
+        # Repassa a vaga para o próximo da fila (ou devolve se não houver ninguém)
+        while True:
+            classe = self._proxima_classe()
+            if classe is None:
+                self.active -= 1
+                return
+            future, enqueued_at = self.queues[classe].popleft()
+            if not future.done():
+                self._registrar_espera(classe, enqueued_at)
+                future.set_result(None)
+                return
+
+    async def run(self, classe: str, func, *args, timeout: Optional[float] = None):
+        """Executa func(*args) quando houver vaga, respeitando a prioridade da classe
+
+        Com timeout, desiste da fila (asyncio.TimeoutError) se a vaga não sair a tempo.
+        """
+        classe = self._classe(classe)
+        enqueued_at = time.monotonic()
+        if self.active < self.concurrency and not any(self.queues.values()):
+            self.active += 1
+            self._registrar_espera(classe, enqueued_at)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            fila = self.queues[classe]
+            fila.append((future, enqueued_at))
+            self.stats[classe]["max_depth"] = max(self.stats[classe]["max_depth"], len(fila))
+            try:
+                await asyncio.wait_for(future, timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                if future.done() and not future.cancelled():
+                    # A vaga já tinha sido repassada: devolve para o próximo
+                    self._liberar()
+                else:
+                    try:
+                        fila.remove((future, enqueued_at))
+                    except ValueError:
+                        pass
+                raise
+        try:
+            return await func(*args)
+        finally:
+            self._liberar()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "weights": self.weights,
+            "classes": {
+                classe: {
+                    "queue_depth": len(self.queues[classe]),
+                    "max_depth": stats["max_depth"],
+                    "dispatched": stats["dispatched"],
+                    "wait_ms_avg": round(stats["wait_ms_total"] / stats["dispatched"], 2) if stats["dispatched"] else 0.0,
+                    "wait_ms_max": round(stats["wait_ms_max"], 2)
+                }
+                for classe, stats in self.stats.items()
+            }
+        }
+
+SCHEDULER = DeliveryScheduler(DELIVERY_CONCURRENCY, DELIVERY_PRIORITY_WEIGHTS)
+
+# Entregas adiadas que ainda estão rodando em segundo plano
+PENDING_DELIVERIES: set = set()
+
+# Entregas em andamento (webhooks aguardando e adiadas): task -> dados para persistir
+INFLIGHT_DELIVERIES: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+# Desligamento do worker: prazo para drenar as entregas e pasta onde ficam as não concluídas
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+DELIVERY_SPOOL_DIR = os.getenv("DELIVERY_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "telein-spool"))
+SPOOL_SCAN_SECONDS = float(os.getenv("SPOOL_SCAN_SECONDS", "30"))
+# Entregas adiadas que falham voltam ao spool com espera exponencial, até o limite de tentativas
+SPOOL_MAX_ATTEMPTS = int(os.getenv("SPOOL_MAX_ATTEMPTS", "5"))
+SPOOL_RETRY_BACKOFF_SECONDS = float(os.getenv("SPOOL_RETRY_BACKOFF_SECONDS", "30"))
+
+# Fica False quando o worker começa a encerrar
+ACCEPTING_WEBHOOKS = True
+
+# Entrega em segundo plano, sem o prazo do webhook que a originou
+async def _entrega_adiada(info: Dict[str, Any]):
+    PRAZO.set(None)
+    if ACCEPTING_WEBHOOKS:
+        await asyncio.sleep(DELIVERY_DEFER_DELAY_SECONDS)
+    nada_enviado = False
+    try:
+        forward_result = await SCHEDULER.run(
+            info["classe"], forward_to_endpoint, info["endpoint_url"], info["data"], info["event_type"]
+        )
+    except (FalhaConexao, PrazoEsgotado) as e:
+        logger.error(f"❌ {e}")
+        nada_enviado = True
+        forward_result = {"status": "error", "forwarded_to": info["endpoint_url"], "error": str(e)}
+    if forward_result.get("status") == "success":
+        if info["spool_path"]:
+            try:
+                os.remove(info["spool_path"])
+            except FileNotFoundError:
+                pass
+    else:
+        # Só reenvia quando nada chegou ao destino ou ele falhou (5xx); timeout no envio
+        # pode ter entregue o lead, e 4xx/dados inválidos não mudam com nova tentativa
+        reenviar = nada_enviado or (forward_result.get("response_status") or 0) >= 500
+        reagendar_entrega(info, forward_result.get("error") or forward_result.get("status"), reenviar)
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
+    return forward_result
+
+# Devolve ao spool uma entrega adiada que falhou; sem reenvio ou esgotadas as tentativas, guarda como .failed
+def reagendar_entrega(info: Dict[str, Any], motivo: Any, reenviar: bool = True):
+    info = {**info, "attempts": info.get("attempts", 0) + 1}
+    try:
+        if not reenviar or info["attempts"] >= SPOOL_MAX_ATTEMPTS:
+            persistir_entrega(info, extensao=".failed")
+            METRICS["spool_failed"] += 1
+            logger.error(f"❌ Entrega para {info['endpoint_url']} desistida após {info['attempts']} tentativa(s): {motivo}")
+        else:
+            atraso = SPOOL_RETRY_BACKOFF_SECONDS * 2 ** (info["attempts"] - 1)
+            persistir_entrega(info, atraso)
+            METRICS["spool_retry_scheduled"] += 1
+            logger.warning(f"🔁 Entrega para {info['endpoint_url']} falhou ({motivo}), nova tentativa em {atraso:.0f}s")
+    except OSError as e:
+        logger.error(f"❌ Não foi possível persistir entrega para {info['endpoint_url']}: {e}")
+
+# Agenda a entrega para depois e responde ao Telein sem bloquear
+def adiar_entrega(
+    classe: str, endpoint_url: str, data: Dict[str, Any], event_type: str, motivo: str,
+    spool_path: Optional[str] = None, attempts: int = 0
+) -> Dict[str, Any]:
+    METRICS["deliveries_deferred"] += 1
+    logger.warning(f"⏳ Entrega adiada para {endpoint_url}: {motivo}")
+    info = {
+        "classe": classe, "endpoint_url": endpoint_url, "data": data, "event_type": event_type,
+        "spool_path": spool_path, "attempts": attempts
+    }
+    task = asyncio.create_task(_entrega_adiada(info))
+    PENDING_DELIVERIES.add(task)
+    task.add_done_callback(PENDING_DELIVERIES.discard)
+    # Registra já na criação: uma task que ainda não começou também precisa ser drenada
+    INFLIGHT_DELIVERIES[task] = info
+    task.add_done_callback(lambda t: INFLIGHT_DELIVERIES.pop(t, None))
+    return {
+        "status": "deferred",
+        "forwarded_to": endpoint_url,
+        "message": f"Entrega adiada: {motivo}"
+    }
+
+# Grava uma entrega não concluída no spool para outro worker retomar
+# (o nome começa pelo instante a partir do qual ela pode ser retomada)
+def persistir_entrega(info: Dict[str, Any], atraso: float = 0.0, extensao: str = ".json"):
+    os.makedirs(DELIVERY_SPOOL_DIR, exist_ok=True)
+    retomar_em = time.time_ns() + int(atraso * 1e9)
+    path = os.path.join(DELIVERY_SPOOL_DIR, f"{retomar_em}-{os.getpid()}-{uuid.uuid4().hex[:8]}{extensao}")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "classe": info["classe"],
+            "endpoint_url": info["endpoint_url"],
+            "data": info["data"],
+            "event_type": info["event_type"],
+            "attempts": info.get("attempts", 0),
+            "persisted_at": datetime.now().isoformat()
+        }, f, ensure_ascii=False, default=str)
+    os.replace(path + ".tmp", path)
+    # A cópia antiga (já reivindicada por este worker) é substituída pela nova
+    if info.get("spool_path"):
+        try:
+            os.remove(info["spool_path"])
+        except FileNotFoundError:
+            pass
+
+# Reivindica as entregas do spool (renomeando o arquivo) e as agenda neste worker
+def recuperar_entregas_spool() -> int:
+    try:
+        nomes = sorted(os.listdir(DELIVERY_SPOOL_DIR))
+    except FileNotFoundError:
+        return 0
+
+    recuperadas = 0
+    for nome in nomes:
+        path = os.path.join(DELIVERY_SPOOL_DIR, nome)
+        if nome.endswith(".claimed"):
+            # Arquivo reivindicado por um worker que morreu sem entregar: devolve ao spool
+            pid = nome.rsplit(".", 2)[-2]
+            if pid.isdigit() and int(pid) != os.getpid():
+                try:
+                    os.kill(int(pid), 0)
+                except ProcessLookupError:
+                    os.replace(path, path.rsplit(".", 2)[0])
+                except PermissionError:
+                    pass
+            continue
+        if not nome.endswith(".json"):
+            continue
+        retomar_em = nome.split("-", 1)[0]
+        if retomar_em.isdigit() and int(retomar_em) > time.time_ns():
+            continue
+        claimed = f"{path}.{os.getpid()}.claimed"
+        try:
+            os.rename(path, claimed)
+            with open(claimed, encoding="utf-8") as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Entrega inválida no spool {nome}: {e}")
+            continue
+        adiar_entrega(
+            info["classe"], info["endpoint_url"], info["data"], info["event_type"], "recuperada do spool",
+            claimed, info.get("attempts", 0)
+        )
+        recuperadas += 1
+
+    if recuperadas:
+        METRICS["spool_recovered"] += recuperadas
+        logger.info(f"♻️ {recuperadas} entregas recuperadas do spool {DELIVERY_SPOOL_DIR}")
+    return recuperadas
+
+# Tarefa de fundo: retoma entregas deixadas por workers reciclados
+async def verificar_spool_periodicamente():
+    while True:
+        await asyncio.sleep(SPOOL_SCAN_SECONDS)
+        recuperar_entregas_spool()
+
+# Espera as entregas em andamento terminarem; o que sobrar vai para o spool
+async def drenar_entregas(timeout: float):
+    tasks = [task for task in INFLIGHT_DELIVERIES if not task.done()]
+    pending = set()
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+
+    persisted = 0
+    for task in pending:
+        info = INFLIGHT_DELIVERIES.get(task)
+        if info is None:
+            continue
+        try:
+            persistir_entrega(info)
+            persisted += 1
+        except OSError as e:
+            logger.error(f"❌ Não foi possível persistir entrega para {info['endpoint_url']}: {e}")
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=1)
+
+    drained = len(tasks) - len(pending)
+    METRICS["shutdown_drained"] += drained
+    METRICS["shutdown_persisted"] += persisted
+    return drained, persisted
+
+# Envia para o destino passando pelo agendador de prioridade, dentro do prazo do webhook
+async def encaminhar(endpoint_url: str, data: Dict[str, Any], event_type: str, key: Optional[str] = None, classe: Optional[str] = None):
+    classe = classe or classe_prioridade(data, key)
+    restante = tempo_restante()
+    if restante is not None and restante < DELIVERY_MIN_BUDGET_SECONDS:
+        METRICS["deadline_overrun_queue"] += 1
+        return adiar_entrega(classe, endpoint_url, data, event_type, "prazo esgotado antes da fila")
+    task = asyncio.current_task()
+    INFLIGHT_DELIVERIES[task] = {"classe": classe, "endpoint_url": endpoint_url, "data": data, "event_type": event_type}
+    try:
+        return await SCHEDULER.run(
+            classe, forward_to_endpoint, endpoint_url, data, event_type,
+            timeout=None if restante is None else restante - DELIVERY_MIN_BUDGET_SECONDS
+        )
+    except asyncio.TimeoutError:
+        METRICS["deadline_overrun_queue"] += 1
+        return adiar_entrega(classe, endpoint_url, data, event_type, "prazo esgotado na fila")
+    except (PrazoEsgotado, FalhaConexao) as e:
+        return adiar_entrega(classe, endpoint_url, data, event_type, str(e))
+    finally:
+        INFLIGHT_DELIVERIES.pop(task, None)
+
+# Limites de validação dos payloads recebidos
+WEBHOOK_MAX_FIELDS = int(os.getenv("WEBHOOK_MAX_FIELDS", "50"))
+WEBHOOK_MAX_FIELD_LENGTH = int(os.getenv("WEBHOOK_MAX_FIELD_LENGTH", "512"))
+
+# Tipos estritos com limite de tamanho
+CampoTexto = Annotated[str, Field(max_length=WEBHOOK_MAX_FIELD_LENGTH)]
+NomeCampo = Annotated[str, Field(max_length=64)]
+ValorEscalar = Union[CampoTexto, int, float, bool, None]
+# Um nível de aninhamento (objetos e listas de valores simples), também limitado
+ValorCampo = Union[
+    ValorEscalar,
+    Annotated[Dict[NomeCampo, ValorEscalar], Field(max_length=WEBHOOK_MAX_FIELDS)],
+    Annotated[List[ValorEscalar], Field(max_length=WEBHOOK_MAX_FIELDS)],
+]
+DadosEvento = Annotated[Dict[NomeCampo, ValorCampo], Field(max_length=WEBHOOK_MAX_FIELDS)]
+
 # Modelo para dados do Telein
 class TeleinWebhook(BaseModel):
-    event_type: Optional[str] = None
-    lead_data: Optional[Dict[str, Any]] = None
-    campaign_data: Optional[Dict[str, Any]] = None
-    client_data: Optional[Dict[str, Any]] = None
-    call_data: Optional[Dict[str, Any]] = None
-    timestamp: Optional[str] = None
-    source: Optional[str] = None
-    key: Optional[str] = None
+    # Campos extras são aceitos (o Telein também manda o lead "achatado" no nível
+    # principal, ex.: {"telefone": ..., "nome": ...}), com os mesmos limites
+    model_config = ConfigDict(strict=True, extra="allow")
+    __pydantic_extra__: Dict[NomeCampo, ValorCampo]
+
+    event_type: Optional[Annotated[str, Field(max_length=64)]] = None
+    lead_data: Optional[DadosEvento] = None
+    campaign_data: Optional[DadosEvento] = None
+    client_data: Optional[DadosEvento] = None
+    call_data: Optional[DadosEvento] = None
+    form_data: Optional[DadosEvento] = None
+    timestamp: Optional[Annotated[str, Field(max_length=64)]] = None
+    source: Optional[Annotated[str, Field(max_length=64)]] = None
+    key: Optional[Annotated[str, Field(max_length=8)]] = None
+    message: Optional[CampoTexto] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _limitar_campos(cls, data: Any) -> Any:
+        if isinstance(data, dict) and len(data) > WEBHOOK_MAX_FIELDS:
+            raise ValueError(f"Payload com mais de {WEBHOOK_MAX_FIELDS} campos")
+        return data
+
+# Modelos por tipo de evento (lead_data/call_data continuam opcionais: o lead pode vir achatado)
+class KeyPressedWebhook(TeleinWebhook):
+    event_type: Literal["key_pressed"]
+    key: Annotated[str, Field(max_length=8)]
+
+class LeadCreatedWebhook(TeleinWebhook):
+    event_type: Literal["lead_created"]
+
+class CallAnsweredWebhook(TeleinWebhook):
+    event_type: Literal["call_answered"]
+
+class ContactFormWebhook(TeleinWebhook):
+    event_type: Literal["contact_form_submitted"]
+
+# Escolhe o modelo pelo event_type (eventos desconhecidos usam o modelo genérico)
+def _tipo_evento(value: Any) -> str:
+    event_type = value.get("event_type") if isinstance(value, dict) else getattr(value, "event_type", None)
+    if event_type in ("key_pressed", "lead_created", "call_answered", "contact_form_submitted"):
+        return event_type
+    return "other"
+
+# Validador compilado uma única vez: bytes JSON -> modelo em um passo
+WEBHOOK_ADAPTER = TypeAdapter(
+    Annotated[
+        Union[
+            Annotated[KeyPressedWebhook, Tag("key_pressed")],
+            Annotated[LeadCreatedWebhook, Tag("lead_created")],
+            Annotated[CallAnsweredWebhook, Tag("call_answered")],
+            Annotated[ContactFormWebhook, Tag("contact_form_submitted")],
+            Annotated[TeleinWebhook, Tag("other")],
+        ],
+        Discriminator(_tipo_evento),
+    ]
+)
+
+# Rejeições de validação por campo ("campo" ou "campo.subcampo" -> quantidade)
+VALIDATION_REJECTIONS: Counter = Counter()
+
+# Valida o payload e contabiliza as rejeições por campo
+def validar_webhook(raw: Union[bytes, Dict[str, Any]]) -> TeleinWebhook:
+    """Valida bytes JSON (ou dict já montado) contra o schema do evento"""
+    try:
+        if isinstance(raw, dict):
+            return WEBHOOK_ADAPTER.validate_python(raw)
+        return WEBHOOK_ADAPTER.validate_json(raw)
+    except ValidationError as e:
+        campos = {
+            _campo_rejeitado(error["loc"])
+            for error in e.errors(include_url=False, include_input=False)
+            if error["type"] != "json_invalid"
+        }
+        VALIDATION_REJECTIONS.update(campos)
+        raise
+
+# Nomes de campo conhecidos (os que o forward_to_endpoint procura) para os contadores
+CAMPOS_CONHECIDOS = set(TeleinWebhook.model_fields) | {
+    "id", "nome", "name", "nome_completo", "cliente_nome", "telefone", "phone", "telefone_1",
+    "cliente_telefone", "cpf", "CPF", "documento", "cliente_cpf", "cpf_cnpj", "mailing",
+    "campanha", "campaign", "campanha_nome", "campaign_name", "campanha_id", "campaign_id",
+    "opcao", "email", "endereco"
+}
+
+SECOES_DADOS = {"lead_data", "campaign_data", "client_data", "call_data", "form_data"}
+
+# Caminho do campo rejeitado sem a tag do evento, ex.: "client_data.nome"; nomes
+# desconhecidos viram "<outro>" para não criar contadores com chaves arbitrárias
+def _campo_rejeitado(loc: tuple) -> str:
+    if len(loc) < 2 or not isinstance(loc[1], str):
+        return "body"
+    campo = loc[1] if loc[1] in CAMPOS_CONHECIDOS else "<outro>"
+    # Só os dicts de dados (client_data, lead_data...) têm um nível de campo abaixo
+    if loc[1] in SECOES_DADOS and len(loc) > 2 and isinstance(loc[2], str):
+        campo += "." + (loc[2] if loc[2] in CAMPOS_CONHECIDOS else "<outro>")
+    return campo
+
+# Resposta de rejeição com os erros de cada campo
+def resposta_invalida(e: ValidationError) -> JSONResponse:
+    METRICS["webhook_validation_rejected"] += 1
+    atualizar_registro(status="invalid")
+    return JSONResponse(
+        status_code=422,
+        content={
+            "status": "error",
+            "message": "Payload inválido",
+            "errors": [
+                {"loc": list(error["loc"]), "type": error["type"], "msg": error["msg"]}
+                for error in e.errors(include_url=False, include_input=False)
+            ]
+        }
+    )
 
 #entradas
 class Lead(BaseModel):
@@ -312,6 +1107,351 @@ class Lead(BaseModel):
     email: str
     endereco: str
 
+# Tokens aceitos nos endpoints de diagnóstico (/debug/profile, /debug/loop-lag)
+DEBUG_TOKENS = tuple(
+    t.strip().encode("utf-8")
+    for t in os.getenv("DEBUG_TOKEN", "").split(",")
+    if t.strip()
+)
+
+# Configurações do profiler e do monitor de lag do event loop
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = 120
+PROFILER_MAX_REQUESTS = 1000
+LOOP_LAG_MONITOR_ENABLED = os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true"
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+
+# Verifica o token dos endpoints de diagnóstico
+def verificar_token_debug(request: Request):
+    """Exige X-Debug-Token (ou ?token=) igual a um dos DEBUG_TOKEN configurados"""
+    if not DEBUG_TOKENS:
+        raise HTTPException(status_code=403, detail="DEBUG_TOKEN não configurado")
+    token = (
+        request.headers.get("x-debug-token") or request.query_params.get(TOKEN_QUERY_PARAM, "")
+    ).encode("utf-8")
+    valid = False
+    for secret in DEBUG_TOKENS:
+        valid |= hmac.compare_digest(secret, token)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Token de debug inválido")
+
+# Monta a pilha "funcao (arquivo:linha);..." da raiz até o frame atual
+def _pilha_colapsada(frame) -> str:
+    partes = []
+    while frame is not None:
+        code = frame.f_code
+        partes.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(partes))
+
+# Profiler por amostragem: uma thread lê as pilhas de todas as threads a cada intervalo
+class SamplingProfiler:
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self.running = False
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.remaining_requests = 0
+        self.inflight = 0
+        self.requests_done: Optional[asyncio.Event] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, requests: int = 0):
+        """Inicia a amostragem; com requests > 0 só amostra durante os próximos webhooks"""
+        if self.running:
+            raise RuntimeError("Profiler já está em execução")
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self.remaining_requests = requests
+        self.inflight = 0
+        self.requests_done = asyncio.Event() if requests else None
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """Para a amostragem e devolve as pilhas colapsadas com a contagem de amostras"""
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.remaining_requests = 0
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while self.running:
+            if not self.requests_done or self.inflight > 0:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    self.stacks[f"{names.get(ident, ident)};{_pilha_colapsada(frame)}"] += 1
+                    self.samples += 1
+            time.sleep(self.interval)
+
+    # Hooks chamados pelo middleware em cada webhook
+    def request_started(self):
+        self.inflight += 1
+
+    def request_finished(self):
+        self.inflight -= 1
+        self.remaining_requests -= 1
+        if self.remaining_requests <= 0 and self.requests_done is not None:
+            self.requests_done.set()
+
+# Formata as pilhas no formato collapsed (flamegraph.pl / speedscope)
+def formatar_collapsed(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+# Formata as pilhas no formato JSON do speedscope (perfil "sampled")
+def formatar_speedscope(stacks: Counter, duration: float) -> Dict[str, Any]:
+    frames: list = []
+    indices: Dict[str, int] = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        sample = []
+        for name in stack.split(";"):
+            if name not in indices:
+                indices[name] = len(frames)
+                frames.append({"name": name})
+            sample.append(indices[name])
+        samples.append(sample)
+        weights.append(count)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"telein-webhook pid {os.getpid()}",
+            "unit": "none",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights
+        }],
+        "name": f"telein-webhook pid {os.getpid()} ({duration:.1f}s)",
+        "exporter": "telein-webhook"
+    }
+
+# Monitor de lag do event loop: uma corrotina marca o "batimento" e uma thread
+# captura a pilha do loop quando o batimento atrasa além do limite
+class LoopLagMonitor:
+    def __init__(self, threshold_ms: float, interval_ms: float = 50, history: int = 50):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.blocks: deque = deque(maxlen=history)
+        self.max_lag_ms = 0.0
+        self.blocked_count = 0
+        self.last_beat = 0.0
+        self.running = False
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.running = True
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = (now - expected) * 1000
+            if lag_ms > self.max_lag_ms:
+                self.max_lag_ms = lag_ms
+            self.last_beat = now
+
+    def _watchdog(self):
+        captured_beat = 0.0
+        while self.running:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            lag = time.monotonic() - beat - self.interval
+            # Captura uma vez por bloqueio, enquanto o callback ainda está executando
+            if lag > self.threshold and beat != captured_beat:
+                captured_beat = beat
+                frame = sys._current_frames().get(self._loop_thread)
+                self.blocked_count += 1
+                self.blocks.append({
+                    "timestamp": datetime.now().isoformat(),
+                    "lag_ms": round(lag * 1000, 1),
+                    "stack": _pilha_colapsada(frame).split(";") if frame is not None else []
+                })
+
+PROFILER = SamplingProfiler(PROFILER_INTERVAL_MS)
+LOOP_MONITOR = LoopLagMonitor(LOOP_LAG_THRESHOLD_MS)
+
+# Middleware ASGI leve: só avisa o profiler quando ele está aguardando webhooks
+class WebhookProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or PROFILER.requests_done is None
+            or not PROFILER.running
+            or scope["path"] != "/webhook/telein"
+        ):
+            await self.app(scope, receive, send)
+            return
+        PROFILER.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            PROFILER.request_finished()
+
+# Logs detalhados no stdout (desligados por padrão: incluem headers e body brutos;
+# os eventos recentes, mascarados, ficam disponíveis em /debug/recent)
+VERBOSE_LOGS = os.getenv("VERBOSE_LOGS", "false").lower() == "true"
+
+def log_verbose(*args):
+    if VERBOSE_LOGS:
+        print(*args)
+
+# Buffer circular com os últimos eventos do worker (deque.append é atômico, sem lock)
+RECENT_EVENTS_SIZE = int(os.getenv("RECENT_EVENTS_SIZE", "200"))
+RECENT_EVENTS_DIR = os.getenv("RECENT_EVENTS_DIR", os.path.join(tempfile.gettempdir(), "telein-recent"))
+RECENT_EVENTS_SNAPSHOT_SECONDS = float(os.getenv("RECENT_EVENTS_SNAPSHOT_SECONDS", "5"))
+RECENT_EVENTS: deque = deque(maxlen=RECENT_EVENTS_SIZE)
+_recent_state = {"version": 0, "saved_version": 0}
+
+# Evento sendo processado na requisição atual
+EVENTO_ATUAL: ContextVar[Optional[Dict[str, Any]]] = ContextVar("evento_atual", default=None)
+
+# Campos com dados pessoais e como mascará-los
+CAMPOS_TELEFONE = {"telefone", "phone", "telefone_1", "cliente_telefone"}
+CAMPOS_DOCUMENTO = {"cpf", "CPF", "documento", "cliente_cpf", "cpf_cnpj"}
+CAMPOS_NOME = {"nome", "name", "nome_completo", "cliente_nome"}
+CAMPOS_OCULTOS = {"email", "endereco", "address", "token", "apikey", "api_key"}
+
+# Mascara sequências longas de dígitos em texto livre, mantendo os 4 últimos
+def mascarar_texto(texto: str) -> str:
+    return re.sub(r"\d{2,}(?=\d{4})", lambda m: "*" * len(m.group(0)), texto)
+
+# Mascara um valor de acordo com o nome do campo
+def _mascarar_valor(campo: str, valor: Any) -> Any:
+    if valor in (None, ""):
+        return valor
+    texto = str(valor)
+    if campo in CAMPOS_TELEFONE:
+        return "*" * max(len(texto) - 4, 0) + texto[-4:]
+    if campo in CAMPOS_DOCUMENTO:
+        return "*" * max(len(texto) - 2, 0) + texto[-2:]
+    if campo in CAMPOS_NOME:
+        return texto.strip()[:1] + "***"
+    if campo in CAMPOS_OCULTOS:
+        return "***"
+    return mascarar_texto(valor) if isinstance(valor, str) else valor
+
+# Mascara dados pessoais em dicts/listas recursivamente
+def mascarar_dados(dados: Any, campo: str = "") -> Any:
+    if isinstance(dados, dict):
+        return {k: mascarar_dados(v, k) for k, v in dados.items()}
+    if isinstance(dados, list):
+        return [mascarar_dados(v, campo) for v in dados]
+    return _mascarar_valor(campo, dados)
+
+# Registra a requisição recebida no buffer e a associa ao contexto atual
+def registrar_requisicao(method: str, path: str, query: Dict[str, str], body: bytes = b"") -> Dict[str, Any]:
+    registro = {
+        "id": uuid.uuid4().hex[:12],
+        "timestamp": datetime.now().isoformat(),
+        "pid": os.getpid(),
+        "request": {
+            "method": method,
+            "path": path,
+            "query": mascarar_dados(query),
+            # Só o tamanho: o conteúdo mascarado entra depois da validação do schema
+            "body": {"length": len(body)} if body else None
+        },
+        "status": "received",
+        "event_type": None,
+        "key": None,
+        "phone_suffix": None,
+        "lead": None,
+        "forward_result": None
+    }
+    RECENT_EVENTS.append(registro)
+    EVENTO_ATUAL.set(registro)
+    _recent_state["version"] += 1
+    return registro
+
+# Atualiza o evento da requisição atual (se houver)
+def atualizar_registro(**campos):
+    registro = EVENTO_ATUAL.get()
+    if registro is not None:
+        registro.update(campos)
+        _recent_state["version"] += 1
+
+# Registra o status final da requisição e devolve o resultado
+def finalizar_registro(result: Dict[str, Any]) -> Dict[str, Any]:
+    atualizar_registro(status=result.get("status"))
+    return result
+
+# Grava o snapshot do buffer deste worker para consulta pelos outros workers
+def salvar_snapshot_eventos():
+    os.makedirs(RECENT_EVENTS_DIR, exist_ok=True)
+    version = _recent_state["version"]
+    path = os.path.join(RECENT_EVENTS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(list(RECENT_EVENTS), f, ensure_ascii=False, default=str)
+    os.replace(path + ".tmp", path)
+    _recent_state["saved_version"] = version
+
+# Tarefa de fundo: grava o snapshot periodicamente, só quando houve mudança
+async def salvar_snapshots_eventos():
+    while True:
+        await asyncio.sleep(RECENT_EVENTS_SNAPSHOT_SECONDS)
+        if _recent_state["version"] != _recent_state["saved_version"]:
+            try:
+                await asyncio.to_thread(salvar_snapshot_eventos)
+            except OSError as e:
+                logger.warning(f"Não foi possível salvar snapshot dos eventos: {e}")
+
+# Lê os snapshots dos outros workers ainda vivos
+def carregar_snapshots_workers() -> list:
+    eventos = []
+    try:
+        arquivos = os.listdir(RECENT_EVENTS_DIR)
+    except FileNotFoundError:
+        return eventos
+    for nome in arquivos:
+        if not nome.endswith(".json"):
+            continue
+        pid = int(nome[:-5]) if nome[:-5].isdigit() else None
+        if pid is None or pid == os.getpid():
+            continue
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(os.path.join(RECENT_EVENTS_DIR, nome), encoding="utf-8") as f:
+                eventos.extend(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return eventos
+
 @app.get("/")
 async def root():
     return {
@@ -320,7 +1460,8 @@ async def root():
         "endpoints": {
             "webhook": "/webhook/telein",
             "lead": "/receber_lead",
-            "health": "/health"
+            "health": "/health",
+            "ready": "/ready"
         }
     }
 
@@ -333,39 +1474,110 @@ async def health_check():
         "service": "Telein Webhook API"
     }
 
+# Limites de prontidão (/ready) e cache da resposta
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", "1"))
+READY_MIN_SUCCESS_RATE = float(os.getenv("READY_MIN_SUCCESS_RATE", "0.5"))
+READY_MAX_P99_MS = float(os.getenv("READY_MAX_P99_MS", "5000"))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "100"))
+_ready_cache: Dict[str, Any] = {"expires": 0.0, "status_code": 200, "body": b""}
+
+# Avalia se o worker deve receber tráfego: destinos saudáveis e fila de entregas curta
+def avaliar_prontidao() -> Dict[str, Any]:
+    reasons = []
+    if not ACCEPTING_WEBHOOKS:
+        reasons.append("worker encerrando")
+
+    destinations = {}
+    for url in set(DESTINATION_ENDPOINTS.values()):
+        saude = saude_destino(url)
+        destinations[url] = saude.snapshot()
+        success_rate = saude.success_rate()
+        p99 = saude.p99_ms()
+        if success_rate is not None and success_rate < READY_MIN_SUCCESS_RATE:
+            reasons.append(f"{url}: taxa de sucesso {success_rate:.0%}")
+        if p99 is not None and p99 > READY_MAX_P99_MS:
+            reasons.append(f"{url}: p99 {p99:.0f} ms")
+
+    queue_depth = sum(len(fila) for fila in SCHEDULER.queues.values())
+    if queue_depth > READY_MAX_QUEUE_DEPTH:
+        reasons.append(f"fila de entregas com {queue_depth} itens")
+
+    return {
+        "ready": not reasons,
+        "reasons": reasons,
+        "pid": os.getpid(),
+        "queue_depth": queue_depth,
+        "inflight_deliveries": len(INFLIGHT_DELIVERIES),
+        "destinations": destinations,
+        "checked_at": datetime.now().isoformat()
+    }
+
+# Endpoint de prontidão para o load balancer (resposta em cache, barato de consultar)
+@app.get("/ready")
+async def ready_check():
+    agora = time.monotonic()
+    if agora >= _ready_cache["expires"]:
+        prontidao = avaliar_prontidao()
+        _ready_cache["status_code"] = 200 if prontidao["ready"] else 503
+        _ready_cache["body"] = json.dumps(prontidao, ensure_ascii=False).encode("utf-8")
+        _ready_cache["expires"] = agora + READY_CACHE_SECONDS
+    return Response(content=_ready_cache["body"], status_code=_ready_cache["status_code"], media_type="application/json")
+
 # Webhook principal para Telein
 @app.post("/webhook/telein")
 async def telein_webhook(request: Request):
+    if not ACCEPTING_WEBHOOKS:
+        raise HTTPException(status_code=503, detail="Worker encerrando", headers={"Retry-After": "1"})
+    iniciar_prazo()
+    # Rejeita sem ler o body: POST sem assinatura ou maior que o limite
+    if WEBHOOK_SECRETS and not request.headers.get(SIGNATURE_HEADER):
+        _contar_autenticacao(False)
+        raise HTTPException(status_code=401, detail="Assinatura inválida")
+    content_length = request.headers.get("content-length", "")
+    if content_length and (not content_length.isdigit() or int(content_length) > WEBHOOK_MAX_BODY_BYTES):
+        raise HTTPException(status_code=413, detail="Body muito grande")
+    # Recebe dados brutos do request (com limite, mesmo sem content-length) e autentica antes de qualquer parse/log
+    body = b""
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > WEBHOOK_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Body muito grande")
+    if not verificar_assinatura(request, body):
+        raise HTTPException(status_code=401, detail="Assinatura inválida")
+    registro = registrar_requisicao(request.method, request.url.path, query_sem_token(request), body)
+
     try:
-        # Recebe dados brutos do request
-        body = await request.body()
-        
-        print("=" * 80)
-        print("🚀 WEBHOOK RECEBIDO - INÍCIO DO PROCESSAMENTO")
-        print("=" * 80)
-        print(f"📅 Timestamp: {datetime.now().isoformat()}")
-        print(f"🌐 URL: {request.url}")
-        print(f"📋 Método: {request.method}")
-        print(f"📦 Headers completos:")
+        log_verbose("=" * 80)
+        log_verbose("🚀 WEBHOOK RECEBIDO - INÍCIO DO PROCESSAMENTO")
+        log_verbose("=" * 80)
+        log_verbose(f"📅 Timestamp: {datetime.now().isoformat()}")
+        log_verbose(f"🌐 URL: {request.url.remove_query_params(TOKEN_QUERY_PARAM)}")
+        log_verbose(f"📋 Método: {request.method}")
+        log_verbose(f"📦 Headers completos:")
         for key, value in request.headers.items():
-            print(f"   {key}: {value}")
-        print(f"📄 Body raw (bytes): {body}")
-        print(f"📄 Body raw (string): {body.decode('utf-8', errors='ignore')}")
-        print(f"🔗 Query parameters: {dict(request.query_params)}")
-        print("-" * 80)
+            log_verbose(f"   {key}: {value}")
+        log_verbose(f"📄 Body raw (bytes): {body}")
+        log_verbose(f"📄 Body raw (string): {body.decode('utf-8', errors='ignore')}")
+        log_verbose(f"🔗 Query parameters: {query_sem_token(request)}")
+        log_verbose("-" * 80)
         
-        # Tenta fazer parse do JSON
+        # Valida o JSON direto dos bytes contra o schema do evento
         try:
-            data = await request.json()
-            print(f"✅ JSON parseado com sucesso:")
-            print(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
-        except Exception as json_error:
-            print(f"❌ Erro ao fazer parse do JSON: {json_error}")
+            evento = validar_webhook(body)
+            data = evento.model_dump(exclude_none=True)
+            registro["request"]["body"] = mascarar_dados(data)
+            log_verbose(f"✅ JSON validado com sucesso:")
+            log_verbose(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
+        except ValidationError as json_error:
+            # JSON bem formado mas fora do schema: rejeita logo
+            if any(error["type"] != "json_invalid" for error in json_error.errors()):
+                return resposta_invalida(json_error)
+            log_verbose(f"❌ Erro ao fazer parse do JSON: {json_error}")
             
             # Tenta extrair dados dos query parameters (formato do Telein)
-            query_params = dict(request.query_params)
+            query_params = query_sem_token(request)
             if query_params:
-                print(f"📋 Query parameters encontrados: {query_params}")
+                log_verbose(f"📋 Query parameters encontrados: {query_params}")
                 data = {
                     "event_type": "key_pressed",
                     "key": "2",  # Assumindo que é tecla 2
@@ -381,47 +1593,53 @@ async def telein_webhook(request: Request):
                     },
                     "source": "telein_query_params"
                 }
-                print(f"✅ Dados extraídos dos query parameters:")
-                print(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
+                # Aplica os mesmos limites de tamanho do schema
+                try:
+                    validar_webhook(data)
+                except ValidationError as e:
+                    return resposta_invalida(e)
+                log_verbose(f"✅ Dados extraídos dos query parameters:")
+                log_verbose(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
             else:
                 # Se não encontrar query params, usa o body como string
                 data = {"raw_body": body.decode('utf-8', errors='ignore')}
-                print(f"⚠️ Usando body como string: {data}")
+                log_verbose(f"⚠️ Usando body como string: {data}")
         
         # Log detalhado dos dados recebidos
-        print("-" * 80)
-        print("📋 ANÁLISE DOS DADOS RECEBIDOS:")
-        print(f"🔍 Event type: {data.get('event_type', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Key: {data.get('key', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Client data: {data.get('client_data', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Lead data: {data.get('lead_data', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Campaign data: {data.get('campaign_data', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Source: {data.get('source', 'NÃO ENCONTRADO')}")
-        print(f"🔍 Timestamp: {data.get('timestamp', 'NÃO ENCONTRADO')}")
-        print("-" * 80)
+        log_verbose("-" * 80)
+        log_verbose("📋 ANÁLISE DOS DADOS RECEBIDOS:")
+        log_verbose(f"🔍 Event type: {data.get('event_type', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Key: {data.get('key', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Client data: {data.get('client_data', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Lead data: {data.get('lead_data', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Campaign data: {data.get('campaign_data', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Source: {data.get('source', 'NÃO ENCONTRADO')}")
+        log_verbose(f"🔍 Timestamp: {data.get('timestamp', 'NÃO ENCONTRADO')}")
+        log_verbose("-" * 80)
         
         # Processa diferentes tipos de eventos
         event_type = data.get("event_type", "unknown")
         key_pressed = data.get("key", "N/A")
+        atualizar_registro(event_type=event_type, key=key_pressed)
         
-        print(f"🎯 DECISÃO DE PROCESSAMENTO:")
-        print(f"   Event type detectado: '{event_type}'")
-        print(f"   Key pressionada: '{key_pressed}'")
-        print(f"   Condição para processar: event_type == 'key_pressed' AND key in ['0','1','2','3','4','5','6','7','8','9']")
-        print(f"   Resultado: {event_type == 'key_pressed' and key_pressed in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']}")
+        log_verbose(f"🎯 DECISÃO DE PROCESSAMENTO:")
+        log_verbose(f"   Event type detectado: '{event_type}'")
+        log_verbose(f"   Key pressionada: '{key_pressed}'")
+        spec = buscar_handler(event_type, key_pressed)
+        log_verbose(f"   Handler registrado: {spec['name'] if spec else 'nenhum'}")
         
-        # Processa se for qualquer tecla de 0 a 9
-        if event_type == "key_pressed" and key_pressed in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"]:
-            print(f"✅ CONDIÇÃO ATENDIDA - Processando tecla {key_pressed} - Criando lead")
-            result = await process_key_pressed(data, key_pressed)
-            print("=" * 80)
-            print("🏁 WEBHOOK PROCESSADO COM SUCESSO")
-            print("=" * 80)
-            return result
+        # Processa se houver handler registrado para o evento (e tecla)
+        if spec is not None:
+            log_verbose(f"✅ HANDLER ENCONTRADO - Processando '{event_type}' com {spec['handler_name']}")
+            result = await processar_evento(spec, data, key_pressed)
+            log_verbose("=" * 80)
+            log_verbose("🏁 WEBHOOK PROCESSADO COM SUCESSO")
+            log_verbose("=" * 80)
+            return finalizar_registro(result)
         else:
             # Para todos os outros casos, apenas loga mas não processa
-            print(f"❌ CONDIÇÃO NÃO ATENDIDA - Ignorando evento")
-            print(f"   Motivo: event_type='{event_type}' ou key='{key_pressed}' não é de 0-9")
+            log_verbose(f"❌ NENHUM HANDLER - Ignorando evento")
+            log_verbose(f"   Motivo: nenhum handler registrado para event_type='{event_type}' e key='{key_pressed}'")
             result = {
                 "status": "ignored",
                 "message": f"Evento ignorado: {event_type}",
@@ -429,47 +1647,54 @@ async def telein_webhook(request: Request):
                 "key": key_pressed,
                 "timestamp": datetime.now().isoformat()
             }
-            print("=" * 80)
-            print("🏁 WEBHOOK IGNORADO")
-            print("=" * 80)
-            return result
+            log_verbose("=" * 80)
+            log_verbose("🏁 WEBHOOK IGNORADO")
+            log_verbose("=" * 80)
+            return finalizar_registro(result)
             
     except Exception as e:
 
         logger.error(f"Erro no webhook: {str(e)}")
 
-        print("=" * 80)
-        print("💥 ERRO NO WEBHOOK")
-        print("=" * 80)
-        print(f"❌ Erro: {str(e)}")
-        print(f"📅 Timestamp: {datetime.now().isoformat()}")
-        print("=" * 80)
+        log_verbose("=" * 80)
+        log_verbose("💥 ERRO NO WEBHOOK")
+        log_verbose("=" * 80)
+        log_verbose(f"❌ Erro: {str(e)}")
+        log_verbose(f"📅 Timestamp: {datetime.now().isoformat()}")
+        log_verbose("=" * 80)
 
         # Retorna erro mas não falha completamente
-        return {
+        return finalizar_registro({
             "status": "error",
             "message": f"Erro ao processar webhook: {str(e)}",
             "timestamp": datetime.now().isoformat()
-        }
+        })
 
 # Webhook GET para Telein (compatibilidade)
 @app.get("/webhook/telein")
 async def telein_webhook_get(request: Request):
     """Endpoint GET para compatibilidade com Telein"""
+    if not ACCEPTING_WEBHOOKS:
+        raise HTTPException(status_code=503, detail="Worker encerrando", headers={"Retry-After": "1"})
+    iniciar_prazo()
+    if not verificar_assinatura(request):
+        raise HTTPException(status_code=401, detail="Assinatura inválida")
+    registrar_requisicao(request.method, request.url.path, query_sem_token(request))
+
     try:
-        print("=" * 80)
-        print("🚀 WEBHOOK GET RECEBIDO - INÍCIO DO PROCESSAMENTO")
-        print("=" * 80)
-        print(f"📅 Timestamp: {datetime.now().isoformat()}")
-        print(f"🌐 URL: {request.url}")
-        print(f"📋 Método: {request.method}")
-        print(f"🔗 Query parameters: {dict(request.query_params)}")
-        print("-" * 80)
+        log_verbose("=" * 80)
+        log_verbose("🚀 WEBHOOK GET RECEBIDO - INÍCIO DO PROCESSAMENTO")
+        log_verbose("=" * 80)
+        log_verbose(f"📅 Timestamp: {datetime.now().isoformat()}")
+        log_verbose(f"🌐 URL: {request.url.remove_query_params(TOKEN_QUERY_PARAM)}")
+        log_verbose(f"📋 Método: {request.method}")
+        log_verbose(f"🔗 Query parameters: {query_sem_token(request)}")
+        log_verbose("-" * 80)
         
         # Extrai dados dos query parameters (formato do Telein)
-        query_params = dict(request.query_params)
+        query_params = query_sem_token(request)
         if query_params:
-            print(f"📋 Query parameters encontrados: {query_params}")
+            log_verbose(f"📋 Query parameters encontrados: {query_params}")
             data = {
                 "event_type": "key_pressed",
                 "key": query_params.get("opcao", "2"),  # Usa a opção real
@@ -485,31 +1710,37 @@ async def telein_webhook_get(request: Request):
                 },
                 "source": "telein_query_params"
             }
-            print(f"✅ Dados extraídos dos query parameters:")
-            print(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
+            # Aplica os mesmos limites de tamanho do schema
+            try:
+                validar_webhook(data)
+            except ValidationError as e:
+                return resposta_invalida(e)
+            log_verbose(f"✅ Dados extraídos dos query parameters:")
+            log_verbose(f"📊 Data parsed: {json.dumps(data, indent=2, ensure_ascii=False)}")
             
             # Processa diferentes tipos de eventos
             event_type = data.get("event_type", "unknown")
             key_pressed = data.get("key", "N/A")
+            atualizar_registro(event_type=event_type, key=key_pressed)
             
-            print(f"🎯 DECISÃO DE PROCESSAMENTO:")
-            print(f"   Event type detectado: '{event_type}'")
-            print(f"   Key pressionada: '{key_pressed}'")
-            print(f"   Condição para processar: event_type == 'key_pressed' AND key in ['0','1','2','3','4','5','6','7','8','9']")
-            print(f"   Resultado: {event_type == 'key_pressed' and key_pressed in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']}")
+            log_verbose(f"🎯 DECISÃO DE PROCESSAMENTO:")
+            log_verbose(f"   Event type detectado: '{event_type}'")
+            log_verbose(f"   Key pressionada: '{key_pressed}'")
+            spec = buscar_handler(event_type, key_pressed)
+            log_verbose(f"   Handler registrado: {spec['name'] if spec else 'nenhum'}")
             
-            # Processa se for qualquer tecla de 0 a 9
-            if event_type == "key_pressed" and key_pressed in ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"]:
-                print(f"✅ CONDIÇÃO ATENDIDA - Processando tecla {key_pressed} - Criando lead")
-                result = await process_key_pressed(data, key_pressed)
-                print("=" * 80)
-                print("🏁 WEBHOOK GET PROCESSADO COM SUCESSO")
-                print("=" * 80)
-                return result
+            # Processa se houver handler registrado para o evento (e tecla)
+            if spec is not None:
+                log_verbose(f"✅ HANDLER ENCONTRADO - Processando '{event_type}' com {spec['handler_name']}")
+                result = await processar_evento(spec, data, key_pressed)
+                log_verbose("=" * 80)
+                log_verbose("🏁 WEBHOOK GET PROCESSADO COM SUCESSO")
+                log_verbose("=" * 80)
+                return finalizar_registro(result)
             else:
                 # Para todos os outros casos, apenas loga mas não processa
-                print(f"❌ CONDIÇÃO NÃO ATENDIDA - Ignorando evento")
-                print(f"   Motivo: event_type='{event_type}' ou key='{key_pressed}' não é de 0-9")
+                log_verbose(f"❌ NENHUM HANDLER - Ignorando evento")
+                log_verbose(f"   Motivo: nenhum handler registrado para event_type='{event_type}' e key='{key_pressed}'")
                 result = {
                     "status": "ignored",
                     "message": f"Evento ignorado: {event_type}",
@@ -517,40 +1748,41 @@ async def telein_webhook_get(request: Request):
                     "key": key_pressed,
                     "timestamp": datetime.now().isoformat()
                 }
-                print("=" * 80)
-                print("🏁 WEBHOOK GET IGNORADO")
-                print("=" * 80)
-                return result
+                log_verbose("=" * 80)
+                log_verbose("🏁 WEBHOOK GET IGNORADO")
+                log_verbose("=" * 80)
+                return finalizar_registro(result)
         else:
-            return {
+            return finalizar_registro({
                 "status": "error",
                 "message": "Nenhum query parameter encontrado",
                 "timestamp": datetime.now().isoformat()
-            }
+            })
             
     except Exception as e:
-        print("=" * 80)
-        print("💥 ERRO NO WEBHOOK GET")
-        print("=" * 80)
-        print(f"❌ Erro: {str(e)}")
-        print(f"📅 Timestamp: {datetime.now().isoformat()}")
-        print("=" * 80)
-        return {
+        log_verbose("=" * 80)
+        log_verbose("💥 ERRO NO WEBHOOK GET")
+        log_verbose("=" * 80)
+        log_verbose(f"❌ Erro: {str(e)}")
+        log_verbose(f"📅 Timestamp: {datetime.now().isoformat()}")
+        log_verbose("=" * 80)
+        return finalizar_registro({
             "status": "error",
             "message": f"Erro ao processar webhook GET: {str(e)}",
             "timestamp": datetime.now().isoformat()
-        }
+        })
 
 # Processa criação de lead
-async def process_lead_created(data: Dict[str, Any]):
+async def process_lead_created(data: Dict[str, Any], key: Optional[str] = None, spec: Optional[Dict[str, Any]] = None):
     lead_data = data.get("lead_data", {})
     
     # Aqui você pode salvar no banco, enviar para CRM, etc.
-    logger.info(f"Processando lead criado: {lead_data}")
+    if VERBOSE_LOGS:
+        logger.info(f"Processando lead criado: {mascarar_dados(lead_data)}")
     
-    # Envia dados para outro endpoint
-    endpoint_url = DESTINATION_ENDPOINTS.get("lead_created", DESTINATION_ENDPOINTS["default"])
-    forward_result = await forward_to_endpoint(endpoint_url, data, "lead_created")
+    # Envia dados para os destinos do handler
+    forward_result = await encaminhar_destinos(spec, data, "lead_created", key)
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
     
     return {
         "status": "success",
@@ -563,12 +1795,13 @@ async def process_lead_created(data: Dict[str, Any]):
 
 
 # Processa quando tecla "2" for pressionada
-async def process_key_pressed_2(data: Dict[str, Any]):
-    logger.info(f"Cliente pressionou tecla 2: {data}")
+async def process_key_pressed_2(data: Dict[str, Any], key: Optional[str] = "2", spec: Optional[Dict[str, Any]] = None):
+    if VERBOSE_LOGS:
+        logger.info(f"Cliente pressionou tecla 2: {mascarar_dados(data)}")
     
     # Envia dados para IPLUC
-    endpoint_url = DESTINATION_ENDPOINTS["default"]
-    forward_result = await forward_to_endpoint(endpoint_url, data, "key_pressed_2")
+    forward_result = await encaminhar_destinos(spec, data, "key_pressed_2", "2")
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
     
     return {
         "status": "success",
@@ -579,29 +1812,29 @@ async def process_key_pressed_2(data: Dict[str, Any]):
     }
 
 # Processa quando qualquer tecla de 0 a 9 for pressionada
-async def process_key_pressed(data: Dict[str, Any], key_pressed: str):
-    print("=" * 80)
-    print(f"🎯 PROCESSANDO TECLA {key_pressed} - INÍCIO")
-    print("=" * 80)
-    print(f"📊 Dados completos recebidos:")
-    print(f"   {json.dumps(data, indent=2, ensure_ascii=False)}")
+async def process_key_pressed(data: Dict[str, Any], key_pressed: str, spec: Optional[Dict[str, Any]] = None):
+    log_verbose("=" * 80)
+    log_verbose(f"🎯 PROCESSANDO TECLA {key_pressed} - INÍCIO")
+    log_verbose("=" * 80)
+    log_verbose(f"📊 Dados completos recebidos:")
+    log_verbose(f"   {json.dumps(data, indent=2, ensure_ascii=False)}")
 
     
     # Extrai dados do cliente que pressionou a tecla
     client_data = data.get("client_data", {})
-    print(f"📋 Client data extraído: {json.dumps(client_data, indent=2, ensure_ascii=False)}")
+    log_verbose(f"📋 Client data extraído: {json.dumps(client_data, indent=2, ensure_ascii=False)}")
     
     # Envia dados para IPLUC
-    endpoint_url = DESTINATION_ENDPOINTS["default"]
-    print(f"🌐 Enviando para endpoint: {endpoint_url}")
-    print(f"🔑 API Key configurada: {API_KEYS['ipluc']['api_key'][:10]}...{API_KEYS['ipluc']['api_key'][-10:] if len(API_KEYS['ipluc']['api_key']) > 20 else '***'}")
+    log_verbose(f"🌐 Enviando para destinos: {spec['destinations'] if spec else ['default']}")
+    log_verbose(f"🔑 API Key configurada: {API_KEYS['ipluc']['api_key'][:10]}...{API_KEYS['ipluc']['api_key'][-10:] if len(API_KEYS['ipluc']['api_key']) > 20 else '***'}")
     
-    forward_result = await forward_to_endpoint(endpoint_url, data, f"key_pressed_{key_pressed}")
+    forward_result = await encaminhar_destinos(spec, data, f"key_pressed_{key_pressed}", key_pressed)
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
     
-    print(f"📤 Resultado do forward: {json.dumps(forward_result, indent=2, ensure_ascii=False)}")
-    print("=" * 80)
-    print(f"🎯 PROCESSANDO TECLA {key_pressed} - FIM")
-    print("=" * 80)
+    log_verbose(f"📤 Resultado do forward: {json.dumps(forward_result, indent=2, ensure_ascii=False)}")
+    log_verbose("=" * 80)
+    log_verbose(f"🎯 PROCESSANDO TECLA {key_pressed} - FIM")
+    log_verbose("=" * 80)
     
     return {
         "status": "success",
@@ -613,15 +1846,16 @@ async def process_key_pressed(data: Dict[str, Any], key_pressed: str):
     }
 
 # Processa quando chamada for atendida
-async def process_call_answered(data: Dict[str, Any]):
-    logger.info(f"Chamada atendida: {data}")
+async def process_call_answered(data: Dict[str, Any], key: Optional[str] = None, spec: Optional[Dict[str, Any]] = None):
+    if VERBOSE_LOGS:
+        logger.info(f"Chamada atendida: {mascarar_dados(data)}")
     
     # Extrai dados da chamada
     call_data = data.get("call_data", {})
     
-    # Envia dados para IPLUC
-    endpoint_url = DESTINATION_ENDPOINTS["default"]
-    forward_result = await forward_to_endpoint(endpoint_url, data, "call_answered")
+    # Envia dados para os destinos do handler
+    forward_result = await encaminhar_destinos(spec, data, "call_answered", key)
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
     
     return {
         "status": "success",
@@ -633,15 +1867,16 @@ async def process_call_answered(data: Dict[str, Any]):
     }
 
 # Processa formulário de contato
-async def process_contact_form(data: Dict[str, Any]):
-    logger.info(f"Formulário de contato: {data}")
+async def process_contact_form(data: Dict[str, Any], key: Optional[str] = None, spec: Optional[Dict[str, Any]] = None):
+    if VERBOSE_LOGS:
+        logger.info(f"Formulário de contato: {mascarar_dados(data)}")
     
     # Extrai dados do formulário
     form_data = data.get("form_data", {})
     
-    # Envia dados para IPLUC
-    endpoint_url = DESTINATION_ENDPOINTS["default"]
-    forward_result = await forward_to_endpoint(endpoint_url, data, "contact_form_submitted")
+    # Envia dados para os destinos do handler
+    forward_result = await encaminhar_destinos(spec, data, "contact_form_submitted", key)
+    atualizar_registro(forward_result=mascarar_dados(forward_result))
     
     return {
         "status": "success",
@@ -652,6 +1887,128 @@ async def process_contact_form(data: Dict[str, Any]):
         "forward_result": forward_result
     }
 
+# Handlers que podem ser usados no registro de eventos (nome -> função)
+HANDLERS_DISPONIVEIS = {
+    "process_key_pressed": process_key_pressed,
+    "process_key_pressed_2": process_key_pressed_2,
+    "process_lead_created": process_lead_created,
+    "process_call_answered": process_call_answered,
+    "process_contact_form": process_contact_form,
+}
+
+# Registro de eventos: "evento" ou "evento:teclas" -> handler, destinos (chaves de
+# DESTINATION_ENDPOINTS ou URLs), prioridade (None = por tecla/campanha) e concorrência
+# máxima (None = sem limite). Pode ser estendido com a variável EVENT_HANDLERS (JSON).
+EVENT_HANDLERS_CONFIG: Dict[str, Dict[str, Any]] = {
+    "key_pressed:0-9": {"handler": "process_key_pressed", "destinations": ["default"]},
+    "lead_created": {"handler": "process_lead_created", "destinations": ["lead_created"]},
+    "call_answered": {"handler": "process_call_answered", "destinations": ["default"]},
+    "contact_form_submitted": {"handler": "process_contact_form", "destinations": ["contact_form_submitted"]},
+    **json.loads(os.getenv("EVENT_HANDLERS", "{}"))
+}
+
+# Expande "0-9", "1,3" ou "1-3,7" na lista de teclas
+def _expandir_teclas(teclas: str) -> list:
+    expandidas = []
+    for parte in teclas.split(","):
+        inicio, _, fim = parte.strip().partition("-")
+        if fim:
+            expandidas.extend(str(tecla) for tecla in range(int(inicio), int(fim) + 1))
+        elif inicio:
+            expandidas.append(inicio)
+    return expandidas
+
+# Monta a tabela (event_type, tecla) -> handler; feita uma vez e consultada em O(1)
+def montar_registro_eventos(config: Dict[str, Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+    registro = {}
+    for nome, opcoes in config.items():
+        handler_name = opcoes.get("handler")
+        if handler_name not in HANDLERS_DISPONIVEIS:
+            raise ValueError(f"Handler desconhecido para '{nome}': {handler_name}")
+        concurrency = opcoes.get("concurrency")
+        spec = {
+            "name": nome,
+            "handler_name": handler_name,
+            "handler": HANDLERS_DISPONIVEIS[handler_name],
+            "destinations": list(opcoes.get("destinations") or ["default"]),
+            "priority": opcoes.get("priority"),
+            "concurrency": concurrency,
+            "limite": asyncio.Semaphore(int(concurrency)) if concurrency else None
+        }
+        event_type, _, teclas = nome.partition(":")
+        for tecla in (_expandir_teclas(teclas) if teclas else [None]):
+            registro[(event_type, tecla)] = spec
+    return registro
+
+EVENT_REGISTRY = montar_registro_eventos(EVENT_HANDLERS_CONFIG)
+
+# Busca o handler do evento: primeiro pela tecla, depois o do evento inteiro
+def buscar_handler(event_type: str, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    return EVENT_REGISTRY.get((event_type, key)) or EVENT_REGISTRY.get((event_type, None))
+
+# Executa o handler respeitando o limite de concorrência dele; a espera pela vaga
+# consome o prazo do webhook e, se ele acabar, as entregas do evento são adiadas
+async def processar_evento(spec: Dict[str, Any], data: Dict[str, Any], key: Optional[str] = None):
+    limite = spec["limite"]
+    if limite is None:
+        return await spec["handler"](data, key, spec)
+    restante = tempo_restante()
+    if restante is None or not limite.locked():
+        await limite.acquire()
+    else:
+        try:
+            if restante < DELIVERY_MIN_BUDGET_SECONDS:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(limite.acquire(), restante - DELIVERY_MIN_BUDGET_SECONDS)
+        except asyncio.TimeoutError:
+            METRICS["deadline_overrun_handler"] += 1
+            return adiar_evento(spec, data, key)
+    try:
+        return await spec["handler"](data, key, spec)
+    finally:
+        limite.release()
+
+# Adia as entregas de um evento que não conseguiu vaga no handler dentro do prazo
+def adiar_evento(spec: Dict[str, Any], data: Dict[str, Any], key: Optional[str] = None) -> Dict[str, Any]:
+    event_type = spec["name"].partition(":")[0]
+    classe = spec["priority"] or classe_prioridade(data, key)
+    results = [
+        adiar_entrega(classe, url, data, event_type, f"prazo esgotado aguardando o handler {spec['name']}")
+        for url in urls_destinos(spec)
+    ]
+    return {
+        "status": "deferred",
+        "message": f"Evento adiado: {event_type}",
+        "event_type": event_type,
+        "timestamp": datetime.now().isoformat(),
+        "forward_result": results[0] if len(results) == 1 else {
+            "status": "deferred", "forwarded_to": [r["forwarded_to"] for r in results], "results": results
+        }
+    }
+
+# URLs dos destinos do handler (sem handler, só o "default")
+def urls_destinos(spec: Optional[Dict[str, Any]]) -> list:
+    destinos = spec["destinations"] if spec else ["default"]
+    return [
+        destino if destino.startswith("http") else DESTINATION_ENDPOINTS.get(destino, DESTINATION_ENDPOINTS["default"])
+        for destino in destinos
+    ]
+
+# Envia para todos os destinos do handler (sem handler, só para o "default")
+async def encaminhar_destinos(spec: Optional[Dict[str, Any]], data: Dict[str, Any], event_type: str, key: Optional[str] = None):
+    classe = spec["priority"] if spec else None
+    urls = urls_destinos(spec)
+    if len(urls) == 1:
+        return await encaminhar(urls[0], data, event_type, key, classe)
+
+    results = await asyncio.gather(*(encaminhar(url, data, event_type, key, classe) for url in urls))
+    statuses = {result["status"] for result in results}
+    return {
+        "status": "error" if "error" in statuses else "deferred" if "deferred" in statuses else "success",
+        "forwarded_to": urls,
+        "results": results
+    }
+
 # Endpoint POST original (mantido para compatibilidade)
 @app.post("/receber_lead")
 async def receber_lead(lead: Lead):
@@ -731,6 +2088,97 @@ async def get_endpoints_config():
         "timestamp": datetime.now().isoformat()
     }
 
+# Endpoint para configurar as prioridades de entrega
+@app.post("/config/priorities")
+async def configure_priorities(priorities: Dict[str, Dict[str, Any]]):
+    """Configura pesos das classes e mapas tecla/campanha -> classe"""
+    SCHEDULER.set_weights({classe: int(peso) for classe, peso in priorities.get("weights", {}).items()})
+    DELIVERY_PRIORITY_KEYS.update({str(k): str(v) for k, v in priorities.get("keys", {}).items()})
+    DELIVERY_PRIORITY_CAMPAIGNS.update({str(k): str(v) for k, v in priorities.get("campaigns", {}).items()})
+
+    return {
+        "status": "success",
+        "message": "Prioridades configuradas com sucesso",
+        "weights": SCHEDULER.weights,
+        "keys": DELIVERY_PRIORITY_KEYS,
+        "campaigns": DELIVERY_PRIORITY_CAMPAIGNS
+    }
+
+# Endpoint para visualizar as prioridades de entrega
+@app.get("/config/priorities")
+async def get_priorities_config():
+    """Retorna a configuração atual das prioridades e o estado das filas"""
+    return {
+        "weights": SCHEDULER.weights,
+        "keys": DELIVERY_PRIORITY_KEYS,
+        "campaigns": DELIVERY_PRIORITY_CAMPAIGNS,
+        "default": DELIVERY_DEFAULT_PRIORITY,
+        "scheduler": SCHEDULER.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Endpoint para registrar/alterar handlers de eventos
+@app.post("/config/event-handlers")
+async def configure_event_handlers(handlers: Dict[str, Dict[str, Any]]):
+    """Configura handlers por evento ("evento" ou "evento:teclas") e remonta o registro"""
+    global EVENT_REGISTRY
+
+    config = {**EVENT_HANDLERS_CONFIG, **handlers}
+    try:
+        registro = montar_registro_eventos(config)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    EVENT_HANDLERS_CONFIG.update(handlers)
+    EVENT_REGISTRY = registro
+
+    return {
+        "status": "success",
+        "message": "Handlers de eventos configurados com sucesso",
+        "event_handlers": EVENT_HANDLERS_CONFIG
+    }
+
+# Endpoint para visualizar o registro de eventos
+@app.get("/config/event-handlers")
+async def get_event_handlers_config():
+    """Retorna a configuração atual dos handlers de eventos"""
+    return {
+        "event_handlers": EVENT_HANDLERS_CONFIG,
+        "available_handlers": list(HANDLERS_DISPONIVEIS),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Endpoint para configurar timeouts por destino
+@app.post("/config/timeouts")
+async def configure_timeouts(timeouts: Dict[str, Dict[str, float]]):
+    """Configura timeouts (connect, write, read, pool) por URL de destino ou default"""
+    validos = {"connect", "write", "read", "pool"}
+    for destino, valores in timeouts.items():
+        invalidos = set(valores) - validos
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Timeouts desconhecidos: {sorted(invalidos)}")
+        DESTINATION_TIMEOUTS.setdefault(destino, {}).update({k: float(v) for k, v in valores.items()})
+
+    return {
+        "status": "success",
+        "message": "Timeouts configurados com sucesso",
+        "timeouts": DESTINATION_TIMEOUTS,
+        "webhook_deadline_seconds": WEBHOOK_DEADLINE_SECONDS
+    }
+
+# Endpoint para visualizar os timeouts por destino
+@app.get("/config/timeouts")
+async def get_timeouts_config():
+    """Retorna o prazo dos webhooks e os timeouts por destino"""
+    return {
+        "webhook_deadline_seconds": WEBHOOK_DEADLINE_SECONDS,
+        "min_budget_seconds": DELIVERY_MIN_BUDGET_SECONDS,
+        "retries": DELIVERY_RETRIES,
+        "timeouts": DESTINATION_TIMEOUTS,
+        "pending_deliveries": len(PENDING_DELIVERIES),
+        "inflight_deliveries": len(INFLIGHT_DELIVERIES),
+        "timestamp": datetime.now().isoformat()
+    }
+
 # Endpoint para configurar chaves de API
 @app.post("/config/api-keys")
 async def configure_api_keys(api_keys: Dict[str, Dict[str, str]]):
@@ -781,36 +2229,18 @@ async def test_ipluc_connection():
                 "solution": "Use o endpoint /config/ipluc-api-key para configurar"
             }
         
-        # Testa com dados fictícios
-        test_payload = {
-            "id": 12345678,  # ID menor para teste
-            "status_id": 15135,
-            "nome": "TESTE CONEXÃO",
-            "telefone_1": formatar_telefone("11999999999"),
-            "cpf": "12345678901",
-            "utm_source": "URA",
-            "cod_convenio": "INSS"
-        }
+        # Sonda o destino (HEAD) em vez de criar um lead de teste na IPLUC
+        endpoint_url = DESTINATION_ENDPOINTS["default"]
+        await sondar_destino(endpoint_url)
+        saude = saude_destino(endpoint_url)
         
-        headers = {
-            "Content-Type": "application/json",
-            "apikey": api_key
+        return {
+            "status": "success" if saude.consecutive_failures == 0 else "error",
+            "message": "Teste de conexão com IPLUC",
+            "endpoint": endpoint_url,
+            "health": saude.snapshot(),
+            "api_key_configured": True
         }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://api.ipluc.com/api/salvar-lead",
-                json=test_payload,
-                headers=headers
-            )
-            
-            return {
-                "status": "success" if response.status_code in [200, 201, 202] else "error",
-                "message": "Teste de conexão com IPLUC",
-                "response_status": response.status_code,
-                "response_body": response.text,
-                "api_key_configured": True
-            }
             
     except Exception as e:
         return {
@@ -881,6 +2311,107 @@ async def debug_environment():
         }
     }
 
+# Endpoint com os contadores do worker
+@app.get("/metrics")
+async def get_metrics():
+    """Retorna os contadores do worker atual"""
+    return {
+        "pid": os.getpid(),
+        "metrics": METRICS,
+        "validation_rejections": dict(VALIDATION_REJECTIONS),
+        "delivery_scheduler": SCHEDULER.snapshot(),
+        "destinations": {url: saude.snapshot() for url, saude in DESTINATION_HEALTH.items()},
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Endpoint para profiling sob demanda do worker atual
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10, requests: int = 0, format: str = "collapsed"):
+    """Amostra o worker por N segundos (ou durante os próximos K webhooks) e retorna as pilhas"""
+    verificar_token_debug(request)
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format deve ser 'collapsed' ou 'speedscope'")
+    seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+    requests = min(max(requests, 0), PROFILER_MAX_REQUESTS)
+
+    try:
+        PROFILER.start(requests=requests)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    try:
+        if requests:
+            # Espera os K webhooks, limitado ao tempo máximo
+            try:
+                await asyncio.wait_for(PROFILER.requests_done.wait(), timeout=PROFILER_MAX_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(seconds)
+    finally:
+        duration = time.monotonic() - PROFILER.started_at
+        stacks = PROFILER.stop()
+
+    if format == "speedscope":
+        return formatar_speedscope(stacks, duration)
+    return PlainTextResponse(formatar_collapsed(stacks), headers={"X-Profile-Pid": str(os.getpid())})
+
+# Endpoint com os bloqueios recentes do event loop
+@app.get("/debug/loop-lag")
+async def debug_loop_lag(request: Request):
+    """Retorna o lag máximo e as pilhas dos callbacks que bloquearam o event loop"""
+    verificar_token_debug(request)
+    return {
+        "pid": os.getpid(),
+        "enabled": LOOP_MONITOR.running,
+        "threshold_ms": LOOP_LAG_THRESHOLD_MS,
+        "max_lag_ms": round(LOOP_MONITOR.max_lag_ms, 1),
+        "blocked_count": LOOP_MONITOR.blocked_count,
+        "recent_blocks": list(LOOP_MONITOR.blocks),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Endpoint com os eventos recentes (dados pessoais mascarados)
+@app.get("/debug/recent")
+async def debug_recent(
+    request: Request,
+    phone_suffix: Optional[str] = None,
+    status: Optional[str] = None,
+    key: Optional[str] = None,
+    merge: bool = False,
+    offset: int = 0,
+    limit: int = 50
+):
+    """Lista os últimos eventos do worker (ou de todos os workers com merge=true)"""
+    verificar_token_debug(request)
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 200)
+
+    eventos = list(RECENT_EVENTS)
+    if merge:
+        eventos.extend(await asyncio.to_thread(carregar_snapshots_workers))
+    eventos.sort(key=lambda e: e["timestamp"], reverse=True)
+
+    if phone_suffix:
+        eventos = [e for e in eventos if (e.get("phone_suffix") or "").endswith(phone_suffix)]
+    if status:
+        eventos = [
+            e for e in eventos
+            if e.get("status") == status or (e.get("forward_result") or {}).get("status") == status
+        ]
+    if key:
+        eventos = [e for e in eventos if e.get("key") == key]
+
+    return {
+        "pid": os.getpid(),
+        "merged": merge,
+        "total": len(eventos),
+        "offset": offset,
+        "limit": limit,
+        "events": eventos[offset:offset + limit],
+        "timestamp": datetime.now().isoformat()
+    }
+
 # Endpoint de debug simples
 @app.get("/debug/test")
 async def debug_test():
@@ -892,6 +2423,92 @@ async def debug_test():
         "version": "3.0"
     }
 
+# Rota rápida (ASGI puro) para o formato GET do Telein: faz o parse da query string
+# direto no lead, sem roteamento/Request do FastAPI, e responde com um corpo fixo
+TELEIN_FAST_ROUTE = os.getenv("TELEIN_FAST_ROUTE", "false").lower() == "true"
+
+# Campos do lead enviados pelo Telein na query string
+CAMPOS_QUERY_TELEIN = ("nome", "telefone", "mailing", "campanha", "opcao", "email", "endereco", "cpf")
+
+# Respostas pré-serializadas (tamanho fixo)
+RESPOSTAS_RAPIDAS = {
+    "success": (200, b'{"status":"success"}'),
+    "deferred": (200, b'{"status":"deferred"}'),
+    "error": (200, b'{"status":"error"}'),
+    "ignored": (200, b'{"status":"ignored"}'),
+    "no_params": (200, b'{"status":"error","message":"Nenhum query parameter encontrado"}'),
+    "invalid": (422, b'{"status":"invalid"}'),
+    "unauthorized": (401, b'{"detail":"Assinatura inv\\u00e1lida"}'),
+    "shutting_down": (503, b'{"detail":"Worker encerrando"}'),
+}
+
+# Processa o GET do Telein e devolve a chave da resposta em RESPOSTAS_RAPIDAS
+async def webhook_get_rapido(query_string: bytes) -> str:
+    if not ACCEPTING_WEBHOOKS:
+        return "shutting_down"
+    iniciar_prazo()
+    params = dict(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True))
+    # Remove o token antes de checar/registrar os parâmetros (como query_sem_token)
+    if not verificar_token(params.pop(TOKEN_QUERY_PARAM, "")):
+        return "unauthorized"
+    if not params:
+        return "no_params"
+
+    registrar_requisicao("GET", "/webhook/telein", params)
+    key = params.get("opcao", "2")
+    data = {
+        "event_type": "key_pressed",
+        "key": key,
+        "client_data": {campo: params.get(campo, "") for campo in CAMPOS_QUERY_TELEIN},
+        "source": "telein_query_params"
+    }
+    try:
+        validar_webhook(data)
+    except ValidationError:
+        METRICS["webhook_validation_rejected"] += 1
+        atualizar_registro(status="invalid")
+        return "invalid"
+
+    atualizar_registro(event_type="key_pressed", key=key)
+    spec = buscar_handler("key_pressed", key)
+    if spec is None:
+        atualizar_registro(status="ignored")
+        return "ignored"
+
+    result = await processar_evento(spec, data, key)
+    atualizar_registro(status=result["status"])
+    forward_status = result.get("forward_result", {}).get("status", result["status"])
+    return forward_status if forward_status in RESPOSTAS_RAPIDAS else "error"
+
+class TeleinFastRoute:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not TELEIN_FAST_ROUTE
+            or scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] != "/webhook/telein"
+        ):
+            await self.app(scope, receive, send)
+            return
+        try:
+            resposta = await webhook_get_rapido(scope["query_string"])
+        except Exception as e:
+            logger.error(f"Erro no webhook GET (rota rápida): {str(e)}")
+            resposta = "error"
+        status, body = RESPOSTAS_RAPIDAS[resposta]
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if status == 503:
+            headers.append((b"retry-after", b"1"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+# Middlewares (o último adicionado é o mais externo: o profiler também enxerga a rota rápida)
+app.add_middleware(TeleinFastRoute)
+app.add_middleware(WebhookProfilerMiddleware)
+
 # Para executar com uvicorn
 if __name__ == "__main__":
     import uvicorn